@@ -0,0 +1,138 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+RECIPES_GENERATION_KEY = 'recipes:generation'
+RECIPES_CACHE_HITS_KEY = 'recipes:cache:hits'
+RECIPES_CACHE_MISSES_KEY = 'recipes:cache:misses'
+RECIPE_DOCUMENT_VERSION_KEY = 'recipes:document:version:{}'
+RECIPE_DOCUMENT_KEY = 'recipes:document:{}:{}'
+
+
+def incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+def get_recipes_generation():
+    """Текущее поколение данных о рецептах.
+
+    Начальное значение берется от времени, чтобы после вытеснения ключа
+    из кэша поколение не вернулось к одному из уже использованных.
+    """
+    generation = cache.get(RECIPES_GENERATION_KEY)
+    if generation is None:
+        cache.add(RECIPES_GENERATION_KEY, time.time_ns() // 1000, timeout=None)
+        generation = cache.get(RECIPES_GENERATION_KEY)
+    return generation
+
+
+def bump_recipes_generation():
+    """Сбрасывает кэш ответов после фиксации текущей транзакции."""
+    transaction.on_commit(_bump_recipes_generation)
+
+
+def _bump_recipes_generation():
+    try:
+        cache.incr(RECIPES_GENERATION_KEY)
+    except ValueError:
+        get_recipes_generation()
+
+
+def get_recipe_document_keys(pks):
+    """Ключи документов рецептов с текущими версиями: ``{pk: key}``."""
+    version_keys = {pk: RECIPE_DOCUMENT_VERSION_KEY.format(pk) for pk in pks}
+    versions = cache.get_many(version_keys.values())
+    for key in version_keys.values():
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return {
+        pk: RECIPE_DOCUMENT_KEY.format(pk, versions[key])
+        for pk, key in version_keys.items()
+    }
+
+
+def invalidate_recipes(*pks):
+    """Меняет версии документов рецептов и сбрасывает кэш ответов после
+    фиксации.
+
+    Версия — случайная строка, все ключи меняются одним ``set_many``.
+    Документ, собранный по старым данным и записанный уже после сброса,
+    остается под прежней версией и больше не читается.
+    """
+    keys = [RECIPE_DOCUMENT_VERSION_KEY.format(pk) for pk in pks]
+    transaction.on_commit(
+        lambda: cache.set_many(
+            {key: uuid.uuid4().hex for key in keys}, timeout=None
+        )
+    )
+    bump_recipes_generation()
+
+
+def get_response_cache_key(request):
+    query = '&'.join(
+        f'{key}={value}'
+        for key, values in sorted(request.query_params.lists())
+        for value in sorted(values)
+    )
+    digest = hashlib.md5(
+        f'{request.get_host()}{request.path}?{query}'.encode()
+    ).hexdigest()
+    return f'recipes:response:{get_recipes_generation()}:{digest}'
+
+
+def cache_anonymous_response(method):
+    """Кэширует ответы анонимным пользователям до изменения рецептов."""
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        key = get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            incr(RECIPES_CACHE_HITS_KEY)
+            return Response(data, headers={'X-Cache': 'HIT'})
+        incr(RECIPES_CACHE_MISSES_KEY)
+        response = method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RECIPES_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+def is_cache_shared():
+    """Виден ли кэш другим процессам (а не только текущему)."""
+    return not isinstance(
+        caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache)
+    )
+
+
+def get_cache_stats():
+    hits = cache.get(RECIPES_CACHE_HITS_KEY, 0)
+    misses = cache.get(RECIPES_CACHE_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many((RECIPES_CACHE_HITS_KEY, RECIPES_CACHE_MISSES_KEY))
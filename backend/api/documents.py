@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+
+from api.cache import get_recipe_document_keys
+from api.relations import get_relations
+from api.serializers import GetRecipeSerializer
+from recipes.models import Recipe
+
+
+def build_recipe_documents(pks, request):
+    """Сериализует не зависящую от пользователя часть рецептов."""
+    anonymous = AnonymousUser()
+    recipes = (
+        Recipe.objects.filter(pk__in=pks)
+        .defer('search_vector')
+        .with_user_flags(anonymous)
+        .with_related(anonymous)
+    )
+    return {
+        document['id']: document
+        for document in GetRecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+    }
+
+
+def render_recipes(recipes, request):
+    """Собирает ответ из сохраненных документов рецептов.
+
+    Ключи документов берутся с версиями до сборки недостающих, поэтому
+    документ, собранный параллельно с изменением рецепта, записывается
+    под уже устаревшей версией (``api.cache.invalidate_recipes``).
+
+    Поверх документа подставляются только флаги текущего пользователя,
+    взятые из кэша его связей (``api.relations``).
+    """
+    relations = get_relations(request) or {
+        'favorites': set(),
+        'cart': set(),
+        'following': set(),
+    }
+    keys = get_recipe_document_keys([recipe.pk for recipe in recipes])
+    documents = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in documents]
+    if missing:
+        built = {
+            keys[pk]: document
+            for pk, document in build_recipe_documents(
+                missing, request
+            ).items()
+        }
+        cache.set_many(built, settings.RECIPE_DOCUMENT_TIMEOUT)
+        documents.update(built)
+    data = []
+    for recipe in recipes:
+        document = documents.get(keys[recipe.pk])
+        if document is None:
+            continue
+        data.append(
+            {
+                **document,
+                'author': {
+                    **document['author'],
+                    'is_subscribed': (
+                        recipe.author_id in relations['following']
+                    ),
+                },
+                'is_favorited': recipe.pk in relations['favorites'],
+                'is_in_shopping_cart': recipe.pk in relations['cart'],
+            }
+        )
+    return data
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+
+from api.pdf import render_pdf
+
+SHOPPING_LIST_EXPORTERS = {}
+
+
+def register_exporter(name, content_type, extension, is_available=None):
+    """Регистрирует формат выгрузки списка покупок.
+
+    Экспортер — генератор, принимающий пользователя и итератор строк
+    ``(name, measurement_unit, amount)`` и выдающий байты по частям.
+    """
+
+    def decorator(exporter):
+        exporter.content_type = content_type
+        exporter.extension = extension
+        exporter.is_available = is_available or (lambda: True)
+        SHOPPING_LIST_EXPORTERS[name] = exporter
+        return exporter
+
+    return decorator
+
+
+def get_exporter(name):
+    exporter = SHOPPING_LIST_EXPORTERS.get(name)
+    if exporter is None or not exporter.is_available():
+        return None
+    return exporter
+
+
+def get_title(user):
+    return f'Список покупок пользователя {user.first_name} {user.last_name}'
+
+
+@register_exporter('txt', 'text/plain; charset=utf-8', 'txt')
+def export_txt(user, rows):
+    yield f'{get_title(user)}\n'.encode('utf-8')
+    for name, measurement_unit, amount in rows:
+        yield f'{name}: {amount}{measurement_unit}\n'.encode('utf-8')
+
+
+@register_exporter('csv', 'text/csv; charset=utf-8', 'csv')
+def export_csv(user, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+@register_exporter('json', 'application/json; charset=utf-8', 'json')
+def export_json(user, rows):
+    separator = '\n'
+    yield b'['
+    for name, measurement_unit, amount in rows:
+        item = json.dumps(
+            {
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            },
+            ensure_ascii=False,
+        )
+        yield f'{separator}{item}'.encode('utf-8')
+        separator = ',\n'
+    yield b'\n]\n'
+
+
+def pdf_font_exists():
+    return os.path.exists(settings.SHOPPING_LIST_PDF_FONT)
+
+
+@register_exporter('pdf', 'application/pdf', 'pdf', pdf_font_exists)
+def export_pdf(user, rows):
+    yield from render_pdf(
+        get_title(user),
+        (
+            f'{name}: {amount} {measurement_unit}'
+            for name, measurement_unit, amount in rows
+        ),
+        settings.SHOPPING_LIST_PDF_FONT,
+    )
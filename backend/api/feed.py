@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from api.pagination import KeysetPagination
+from recipes.models import FeedEntry, Recipe
+from users.models import SubscribeUser
+
+POPULAR_AUTHORS_KEY = 'feed:popular_authors'
+
+
+def get_popular_author_ids():
+    """id авторов, у которых подписчиков больше ``FEED_FANOUT_LIMIT``.
+
+    Их рецепты не раскладываются по лентам, а читаются при запросе ленты.
+    Множество кэшируется на ``FEED_POPULAR_AUTHORS_TIMEOUT`` секунд.
+    """
+    author_ids = cache.get(POPULAR_AUTHORS_KEY)
+    if author_ids is None:
+        author_ids = set(
+            SubscribeUser.objects.values('author')
+            .annotate(followers=Count('pk'))
+            .filter(followers__gt=settings.FEED_FANOUT_LIMIT)
+            .values_list('author', flat=True)
+        )
+        cache.set(
+            POPULAR_AUTHORS_KEY,
+            author_ids,
+            settings.FEED_POPULAR_AUTHORS_TIMEOUT,
+        )
+    return author_ids
+
+
+def add_latest_recipes(user_ids, author_id):
+    """Раскладывает последние рецепты автора по лентам.
+
+    Ленты здесь не обрезаются: это делает ``rebuild_feeds --trim``.
+    """
+    FeedEntry.objects.add(
+        user_ids,
+        Recipe.objects.filter(author_id=author_id)
+        .order_by('-pub_date')
+        .values_list('pk', 'pub_date')[: settings.FEED_BACKFILL_LIMIT],
+    )
+
+
+def fan_out_recipe(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    if recipe.author_id in get_popular_author_ids():
+        return
+    FeedEntry.objects.add(
+        SubscribeUser.objects.filter(author_id=recipe.author_id).values_list(
+            'user_id', flat=True
+        ),
+        [(recipe.pk, recipe.pub_date)],
+    )
+
+
+def backfill_author(user_id, author_id):
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    if author_id in get_popular_author_ids():
+        return
+    add_latest_recipes([user_id], author_id)
+
+
+def remove_author(user_id, author_id):
+    """Убирает из ленты рецепты автора после отписки.
+
+    Если после отписки автор перестал быть популярным, его рецепты
+    больше не читаются при запросе ленты, поэтому последние из них
+    раскладываются по лентам оставшихся подписчиков.
+    """
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+    followers = SubscribeUser.objects.filter(author_id=author_id)
+    if (
+        author_id in get_popular_author_ids()
+        and followers.count() <= settings.FEED_FANOUT_LIMIT
+    ):
+        add_latest_recipes(
+            followers.values_list('user_id', flat=True), author_id
+        )
+        transaction.on_commit(lambda: cache.delete(POPULAR_AUTHORS_KEY))
+
+
+class FeedPagination(KeysetPagination):
+    """Keyset-пагинация ленты подписок.
+
+    Записи ленты выбираются по индексу ``(user, -pub_date, -recipe)``,
+    рецепты популярных авторов — отдельным запросом; обе выборки
+    сливаются по ``(pub_date, id)``, после чего рецепты страницы
+    загружаются по id из переданной выборки.
+    """
+
+    ordering = ('-pub_date', '-id')
+
+    def get_rows(self, queryset, position, reverse, limit):
+        user = self.request.user
+        entries = FeedEntry.objects.filter(user=user)
+        sources = [(entries, ('pub_date', 'recipe_id'))]
+        popular = list(
+            SubscribeUser.objects.filter(
+                user=user, author_id__in=get_popular_author_ids()
+            ).values_list('author_id', flat=True)
+        )
+        if popular:
+            # Записи, разложенные до того, как автор стал популярным,
+            # читаются из второй выборки.
+            sources = [
+                (
+                    entries.exclude(recipe__author_id__in=popular),
+                    ('pub_date', 'recipe_id'),
+                ),
+                (
+                    Recipe.objects.filter(author_id__in=popular),
+                    ('pub_date', 'id'),
+                ),
+            ]
+        keys = []
+        for source, fields in sources:
+            if position is not None:
+                source = source.filter(
+                    self.get_keyset_filter(position, reverse, fields)
+                )
+            keys.extend(
+                source.order_by(
+                    *self.get_ordering(reverse, fields)
+                ).values_list(*fields)[:limit]
+            )
+        keys = sorted(keys, reverse=not reverse)[:limit]
+        recipes = queryset.in_bulk([pk for _, pk in keys])
+        return [recipes[pk] for _, pk in keys if pk in recipes]
@@ -1,15 +1,20 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe
+from api.registries import tag_registry
+from api.search import search_recipes
+from recipes.models import FavoriteRecipe, Recipe, RecipeTag, ShoppingCart
 
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+def tag_choices():
+    return tag_registry.choices()
 
 
 class AuthorAndTagFilter(FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
+    )
+    search = filters.CharFilter(method='filter_search')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
@@ -19,16 +24,41 @@ class AuthorAndTagFilter(FilterSet):
         model = Recipe
         fields = ('tags', 'author')
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(
+            Exists(
+                RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'),
+                    tag_id__in=tag_registry.get_ids(value),
+                )
+            )
+        )
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(
-                recipes_favoriterecipe_recipe__user=self.request.user
+                Exists(
+                    FavoriteRecipe.objects.filter(
+                        user=self.request.user, recipe=OuterRef('pk')
+                    )
+                )
             )
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(
-                recipes_shoppingcart_recipe__user=self.request.user
+                Exists(
+                    ShoppingCart.objects.filter(
+                        user=self.request.user, recipe=OuterRef('pk')
+                    )
+                )
             )
         return queryset
@@ -0,0 +1,104 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+from api.cache import invalidate_recipes
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+RENDITIONS_DIR = 'recipes/renditions'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images',
+)
+
+
+def get_format():
+    """WebP, если Pillow собран с его поддержкой, иначе JPEG."""
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def rendition_paths(name):
+    extension = get_format()[1]
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    return {
+        rendition: posixpath.join(
+            RENDITIONS_DIR, f'{stem}_{rendition}.{extension}'
+        )
+        for rendition in RENDITIONS
+    }
+
+
+def make_renditions(name, storage=default_storage, overwrite=False):
+    """Сохраняет уменьшенные копии изображения и возвращает их пути.
+
+    Имена копий выводятся из имени оригинала, а оригиналы называются по
+    хешу содержимого, поэтому уже построенные копии переиспользуются,
+    если не передан ``overwrite``.
+    """
+    paths = rendition_paths(name)
+    if not overwrite and all(map(storage.exists, paths.values())):
+        return paths
+    image_format = get_format()[0]
+    with storage.open(name) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    if image_format == 'JPEG' or original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGB')
+    renditions = {}
+    for rendition, size in RENDITIONS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, image_format, quality=80)
+        path = paths[rendition]
+        if storage.exists(path):
+            storage.delete(path)
+        renditions[rendition] = storage.save(
+            path, ContentFile(buffer.getvalue())
+        )
+    return renditions
+
+
+def process_recipe_image(pk, name, overwrite=False):
+    """Строит копии изображения рецепта и записывает их пути в рецепт.
+
+    Если изображение рецепта за это время сменилось, результат
+    отбрасывается: копии для нового изображения построит его задача.
+    """
+    renditions = make_renditions(name, overwrite=overwrite)
+    if Recipe.objects.filter(pk=pk, image=name).update(renditions=renditions):
+        invalidate_recipes(pk)
+
+
+def process_in_background(pk, name):
+    try:
+        process_recipe_image(pk, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s', pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(recipe):
+    """Ставит обработку изображения в фоновую очередь после фиксации."""
+    pk, name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(process_in_background, pk, name)
+    )
@@ -0,0 +1,122 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.exporters import SHOPPING_LIST_EXPORTERS
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет выгрузку списка покупок во всех форматах: время, размер '
+        'файла и пик памяти. Корзина из --recipes рецептов создается в '
+        'транзакции, которая затем откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=1000)
+        parser.add_argument('--per-recipe', type=int, default=10)
+
+    def seed(self, options):
+        user = User.objects.create(
+            username='benchmark_exports',
+            email='benchmark_exports@example.com',
+            first_name='Benchmark',
+            last_name='Exports',
+        )
+        # Каждое десятое название длинное, чтобы проверить перенос строк.
+        suffix = 'очень длинное название ингредиента ' * 4
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f'benchmark {index} {suffix if index % 10 == 0 else ""}',
+                measurement_unit='г',
+            )
+            for index in range(options['ingredients'])
+        )
+        if not ingredients[0].pk:
+            ingredients = list(
+                Ingredient.objects.filter(name__startswith='benchmark ')
+            )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=user,
+                name=f'benchmark {index}',
+                text='benchmark',
+                cooking_time=1,
+                image='recipes/images/benchmark.png',
+            )
+            for index in range(options['recipes'])
+        )
+        if not recipes[0].pk:
+            recipes = list(Recipe.objects.filter(author=user))
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient=ingredients[
+                        (index * options['per_recipe'] + offset)
+                        % len(ingredients)
+                    ],
+                    amount=offset + 1,
+                )
+                for index, recipe in enumerate(recipes)
+                for offset in range(options['per_recipe'])
+            ),
+            batch_size=1000,
+        )
+        ShoppingCart.objects.bulk_create(
+            (ShoppingCart(user=user, recipe=recipe) for recipe in recipes),
+            batch_size=1000,
+        )
+        ShoppingListItem.objects.add_recipes(
+            [user.pk], [recipe.pk for recipe in recipes]
+        )
+        return user
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options)
+            rows = (
+                ShoppingListItem.objects.filter(user=user)
+                .values_list(
+                    'ingredient__name',
+                    'ingredient__measurement_unit',
+                    'total_amount',
+                )
+                .order_by('ingredient__name')
+            )
+            self.stdout.write(
+                f'Корзина: {options["recipes"]} рецептов, '
+                f'{rows.count()} строк списка покупок'
+            )
+            for name, exporter in SHOPPING_LIST_EXPORTERS.items():
+                if not exporter.is_available():
+                    self.stdout.write(f'Export {name}\t\tнедоступен')
+                    continue
+                tracemalloc.start()
+                started = time.monotonic()
+                size = sum(
+                    len(chunk) for chunk in exporter(user, rows.iterator())
+                )
+                elapsed = time.monotonic() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stdout.write(
+                    f'Export {name}\t\t'
+                    + '\033[32m{}'.format(
+                        f'{elapsed:.2f} с, {size} байт, '
+                        f'пик памяти {peak / 2 ** 20:.1f} МБ'
+                    )
+                    + '\033[0m'
+                )
+            transaction.set_rollback(True)
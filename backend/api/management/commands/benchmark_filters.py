@@ -0,0 +1,139 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from api.filters import AuthorAndTagFilter
+from api.registries import tag_registry
+from recipes.models import FavoriteRecipe, Recipe, RecipeTag, ShoppingCart, Tag
+from users.models import User
+
+PAGE_SIZE = 6
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает планы и время фильтров рецептов по тегам, избранному '
+        'и списку покупок: прежние JOIN с DISTINCT против EXISTS. Данные '
+        'создаются в транзакции, которая затем откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--tags', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def seed(self, options):
+        user = User.objects.create(
+            username='benchmark_filters',
+            email='benchmark_filters@example.com',
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(
+                name=f'benchmark {index}',
+                color=f'#{index:06X}',
+                slug=f'benchmark-{index}',
+            )
+            for index in range(options['tags'])
+        )
+        if not tags[0].pk:
+            tags = list(Tag.objects.filter(slug__startswith='benchmark-'))
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=user,
+                    name=f'benchmark {index}',
+                    text='benchmark',
+                    cooking_time=1,
+                    image='recipes/images/benchmark.png',
+                )
+                for index in range(options['recipes'])
+            ),
+            batch_size=1000,
+        )
+        recipe_ids = list(
+            Recipe.objects.filter(author=user).values_list('pk', flat=True)
+        )
+        RecipeTag.objects.bulk_create(
+            (
+                RecipeTag(recipe_id=pk, tag=tags[(index + offset) % len(tags)])
+                for index, pk in enumerate(recipe_ids)
+                for offset in range(2)
+            ),
+            batch_size=1000,
+        )
+        for model, step in ((FavoriteRecipe, 7), (ShoppingCart, 11)):
+            model.objects.bulk_create(
+                (model(user=user, recipe_id=pk) for pk in recipe_ids[::step]),
+                batch_size=1000,
+            )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (Recipe, RecipeTag, FavoriteRecipe, ShoppingCart):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+        tag_registry.invalidate()
+        return user, [tag.slug for tag in tags[:2]]
+
+    def get_cases(self, user, slugs):
+        """Пары запросов: прежний фильтр через JOIN и текущий фильтр."""
+        recipes = Recipe.objects.all()
+        request = RequestFactory().get('/api/recipes/')
+        request.user = user
+
+        def current(data):
+            return AuthorAndTagFilter(
+                data, queryset=recipes, request=request
+            ).qs
+
+        tag_ids = list(
+            Tag.objects.filter(slug__in=slugs).values_list('pk', flat=True)
+        )
+        return (
+            (
+                'tags',
+                recipes.filter(recipesTag__tag_id__in=tag_ids).distinct(),
+                current({'tags': slugs}),
+            ),
+            (
+                'is_favorited',
+                recipes.filter(recipes_favoriterecipe_recipe__user=user),
+                current({'is_favorited': 'true'}),
+            ),
+            (
+                'is_in_shopping_cart',
+                recipes.filter(recipes_shoppingcart_recipe__user=user),
+                current({'is_in_shopping_cart': 'true'}),
+            ),
+            (
+                'tags + is_favorited',
+                recipes.filter(
+                    recipesTag__tag_id__in=tag_ids,
+                    recipes_favoriterecipe_recipe__user=user,
+                ).distinct(),
+                current({'tags': slugs, 'is_favorited': 'true'}),
+            ),
+        )
+
+    def measure(self, label, queryset, repeat):
+        page = queryset.order_by('-pub_date')[:PAGE_SIZE]
+        started = time.monotonic()
+        for _ in range(repeat):
+            list(page.values_list('pk', flat=True))
+        elapsed = (time.monotonic() - started) / repeat
+        self.stdout.write(
+            f'{label}\t\t'
+            + '\033[32m{}'.format(f'{elapsed * 1000:.1f} мс')
+            + '\033[0m'
+        )
+        for line in page.explain().splitlines():
+            self.stdout.write(f'    {line}')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, slugs = self.seed(options)
+            for name, before, after in self.get_cases(user, slugs):
+                self.stdout.write(f'\n{name}')
+                self.measure('  JOIN', before, options['repeat'])
+                self.measure('  EXISTS', after, options['repeat'])
+            transaction.set_rollback(True)
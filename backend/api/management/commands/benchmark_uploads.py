@@ -0,0 +1,150 @@
+import base64
+import io
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Tag
+from users.models import User
+
+
+class NamedBytesIO(io.BytesIO):
+    name = 'benchmark.png'
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (Linux)."""
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пиковый RSS при загрузке рецепта с изображением в '
+        'base64 (JSON) и файлом (multipart). Каждый путь выполняется в '
+        'отдельном процессе, данные откатываются, файлы пишутся во '
+        'временный каталог.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels',
+            type=float,
+            default=4,
+            help='Размер тестового изображения (шум, PNG без сжатия).',
+        )
+
+    def make_image(self, megapixels):
+        side = int((megapixels * 10**6) ** 0.5)
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(
+            buffer, 'PNG', compress_level=0
+        )
+        return buffer.getvalue()
+
+    def make_requests(self, image):
+        """Тела запросов собираются заранее, чтобы не мерить клиент."""
+        fields = {
+            'name': 'benchmark',
+            'text': 'benchmark',
+            'cooking_time': 1,
+        }
+        encoded = base64.b64encode(image).decode()
+        return {
+            'base64': (
+                'application/json',
+                lambda tag, ingredient: json.dumps(
+                    {
+                        **fields,
+                        'tags': [tag],
+                        'ingredients': [{'id': ingredient, 'amount': 1}],
+                        'image': f'data:image/png;base64,{encoded}',
+                    }
+                ),
+            ),
+            'multipart': (
+                MULTIPART_CONTENT,
+                lambda tag, ingredient: encode_multipart(
+                    BOUNDARY,
+                    {
+                        **fields,
+                        'tags': json.dumps([tag]),
+                        'ingredients': json.dumps(
+                            [{'id': ingredient, 'amount': 1}]
+                        ),
+                        'image': NamedBytesIO(image),
+                    },
+                ),
+            ),
+        }
+
+    @staticmethod
+    def run(content_type, make_body, results):
+        try:
+            results.put(Command.measure(content_type, make_body))
+        except Exception as error:
+            results.put(error)
+
+    @staticmethod
+    def measure(content_type, make_body):
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            MEDIA_ROOT=media
+        ), transaction.atomic():
+            user = User.objects.create(
+                username='benchmark_uploads',
+                email='benchmark_uploads@example.com',
+            )
+            tag = Tag.objects.create(
+                name='benchmark', color='#000000', slug='benchmark-uploads'
+            )
+            ingredient = Ingredient.objects.create(
+                name='benchmark uploads', measurement_unit='г'
+            )
+            client = APIClient()
+            client.force_authenticate(user)
+            body = make_body(tag.pk, ingredient.pk)
+            baseline = current_rss()
+            started = time.monotonic()
+            response = client.generic(
+                'POST', '/api/recipes/', body, content_type
+            )
+            elapsed = time.monotonic() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            transaction.set_rollback(True)
+        return response.status_code, elapsed, max(peak - baseline, 0)
+
+    def handle(self, *args, **options):
+        image = self.make_image(options['megapixels'])
+        self.stdout.write(f'Изображение: {len(image) / 2 ** 20:.1f} МБ')
+        context = multiprocessing.get_context('fork')
+        for name, (content_type, make_body) in self.make_requests(
+            image
+        ).items():
+            results = context.Queue()
+            process = context.Process(
+                target=self.run, args=(content_type, make_body, results)
+            )
+            process.start()
+            result = results.get()
+            process.join()
+            if isinstance(result, Exception):
+                raise CommandError(f'Upload {name}: {result}')
+            status, elapsed, growth = result
+            self.stdout.write(
+                f'Upload {name}\t\t'
+                + '\033[32m{}'.format(
+                    f'HTTP {status}, {elapsed:.2f} с, '
+                    f'прирост RSS {growth / 2 ** 20:.0f} МБ'
+                )
+                + '\033[0m'
+            )
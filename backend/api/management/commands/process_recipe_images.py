@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии изображений рецептов, у которых их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересобрать копии для всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(renditions={})
+        count = 0
+        for pk, name in recipes.values_list('pk', 'image').iterator():
+            try:
+                process_recipe_image(pk, name, overwrite=options['all'])
+            except Exception as error:
+                self.stderr.write(f'Рецепт {pk}: {error}')
+                continue
+            count += 1
+        self.stdout.write(
+            'Process recipe images\t\t'
+            + '\033[32m{}'.format(count)
+            + '\033[0m'
+        )
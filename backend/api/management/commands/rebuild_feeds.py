@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.feed import get_popular_author_ids
+from recipes.models import FeedEntry, Recipe
+from users.models import SubscribeUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет ленты подписок по текущим подпискам и обрезает их '
+        'до FEED_MAX_ENTRIES записей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trim',
+            action='store_true',
+            help='Только обрезать ленты, не заполняя их.',
+        )
+
+    def backfill(self):
+        popular = get_popular_author_ids()
+        recipes = {}
+        for recipe_id, author_id, pub_date in (
+            Recipe.objects.exclude(author_id__in=popular)
+            .latest_per_author(settings.FEED_BACKFILL_LIMIT)
+            .values_list('pk', 'author_id', 'pub_date')
+            .iterator()
+        ):
+            recipes.setdefault(author_id, []).append((recipe_id, pub_date))
+        for author_id, author_recipes in recipes.items():
+            FeedEntry.objects.add(
+                SubscribeUser.objects.filter(author_id=author_id).values_list(
+                    'user_id', flat=True
+                ),
+                author_recipes,
+            )
+
+    def handle(self, *args, **options):
+        if not options['trim']:
+            self.backfill()
+            self.stdout.write(
+                'Backfill feeds\t\t' + '\033[32m{}'.format('OK') + '\033[0m'
+            )
+        deleted = FeedEntry.objects.trim(settings.FEED_MAX_ENTRIES)
+        self.stdout.write(
+            'Trim feeds\t\t' + '\033[32m{}'.format(deleted) + '\033[0m'
+        )
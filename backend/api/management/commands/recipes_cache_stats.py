@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import get_cache_stats, is_cache_shared, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Статистика попаданий в кэш ответов для анонимных запросов. '
+        'Требует общего для процессов кэша (MEMCACHED_LOCATION); с кэшем '
+        'в памяти процесса статистику отдает GET /api/recipes/cache_stats/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', help='Обнулить счетчики.'
+        )
+
+    def handle(self, *args, **options):
+        if not is_cache_shared():
+            raise CommandError(
+                'Кэш хранится в памяти процесса сервера, команда его не '
+                'видит. Задайте MEMCACHED_LOCATION или используйте '
+                'GET /api/recipes/cache_stats/ от имени администратора.'
+            )
+        stats = get_cache_stats()
+        self.stdout.write(
+            f'hits: {stats["hits"]}\t'
+            f'misses: {stats["misses"]}\t'
+            f'hit rate: {stats["hit_rate"]:.1%}'
+        )
+        if options['reset']:
+            reset_cache_stats()
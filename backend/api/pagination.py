@@ -1,6 +1,322 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по статистике планировщика PostgreSQL.
+
+    Для запроса без условий берется ``pg_class.reltuples``, иначе — оценка
+    строк из ``EXPLAIN``. На других СУБД возвращает ``None``.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                (queryset.model._meta.db_table,),
+            )
+            row = cursor.fetchone()
+            if row is None or row[0] < 0:
+                return None
+            return int(row[0])
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximatePage(Page):
+    has_more = None
+
+    def has_next(self):
+        if self.has_more is not None:
+            return self.has_more
+        return super().has_next()
+
+
+class ApproximateCountPaginator(DjangoPaginator):
+    """Пагинатор, подставляющий оценку вместо COUNT(*) на больших выборках.
+
+    Если оценка ниже порога, считается точное количество. При
+    приблизительном ``count`` наличие следующей страницы определяется
+    выборкой одной лишней строки, а не по числу страниц.
+    """
+
+    threshold = settings.APPROXIMATE_COUNT_THRESHOLD
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_approximate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= self.threshold:
+            self.is_approximate = True
+            return estimate
+        return super().count
+
+    def validate_number(self, number):
+        if not (self.count and self.is_approximate):
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы должен быть целым числом.')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1.')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.is_approximate:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page + 1
+        object_list = list(self.object_list[bottom:top])
+        page = self._get_page(object_list[: self.per_page], number, self)
+        page.has_more = len(object_list) > self.per_page
+        return page
+
+    def _get_page(self, *args, **kwargs):
+        return ApproximatePage(*args, **kwargs)
+
+
+class ApproximateCountPagination(LimitPageNumberPagination):
+    """Постраничная пагинация с приблизительным ``count`` для больших
+    таблиц; ответ помечается полем ``count_is_approximate``."""
+
+    django_paginator_class = ApproximateCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data[
+            'count_is_approximate'
+        ] = self.page.paginator.is_approximate
+        return response
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу: без COUNT(*) и OFFSET.
+
+    Позиция страницы — значения полей ``ordering`` последнего (или первого)
+    объекта, упакованные в непрозрачный курсор. Порядок берется из
+    ``cursor_ordering`` представления и должен заканчиваться уникальным
+    полем.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+        results = self.get_rows(
+            queryset, position, reverse, self.page_size + 1
+        )
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if reverse:
+            self.page.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_position = (
+            self.get_position(self.page[-1])
+            if has_next and self.page
+            else None
+        )
+        self.previous_position = (
+            self.get_position(self.page[0])
+            if has_previous and self.page
+            else None
+        )
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ('next', self.get_link(self.next_position, False)),
+                    ('previous', self.get_link(self.previous_position, True)),
+                    ('results', data),
+                ]
+            )
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_rows(self, queryset, position, reverse, limit):
+        """Первые ``limit`` объектов после позиции в порядке обхода."""
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(position, reverse)
+            )
+        return list(queryset.order_by(*self.get_ordering(reverse))[:limit])
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_ordering(self, reverse, fields=None):
+        """Порядок обхода; ``fields`` подменяет имена полей ``ordering``."""
+        ordering = self.ordering
+        if fields is not None:
+            ordering = [
+                field[: len(field) - len(field.lstrip('-'))] + name
+                for field, name in zip(ordering, fields)
+            ]
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        return ordering
+
+    def get_keyset_filter(self, position, reverse, fields=None):
+        """Строит условие «после позиции» для составного ключа.
+
+        ``fields`` — имена тех же полей в другой модели, если условие
+        накладывается на выборку, отличную от пагинируемой.
+        """
+        keyset_filter = Q()
+        equal = {}
+        for field, name, value in zip(
+            self.ordering,
+            fields or [field.lstrip('-') for field in self.ordering],
+            position,
+        ):
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            keyset_filter |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return keyset_filter
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def decode_cursor(self, request, model):
+        """Разбирает курсор и приводит значения к типам полей ``model``."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+            if not isinstance(position, list) or len(position) != len(
+                self.ordering
+            ):
+                raise ValueError(self.invalid_cursor_message)
+            position = [
+                self.parse_value(model, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (
+            binascii.Error,
+            ValueError,
+            TypeError,
+            KeyError,
+            ValidationError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def parse_value(model, field, value):
+        if value is None or isinstance(value, (dict, list)):
+            raise ValueError(value)
+        return model._meta.get_field(field.lstrip('-')).to_python(value)
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def get_link(self, position, reverse):
+        if position is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            self.encode_cursor(position, reverse),
+        )
+
+
+class OptionalCursorPagination(ApproximateCountPagination):
+    """Постраничная пагинация с режимом курсора по запросу клиента.
+
+    Курсорный режим включается параметром ``cursor`` (для первой страницы
+    достаточно пустого значения: ``?cursor=``). Без него ответ сохраняет
+    прежний формат с ``count``. С параметрами ``cursor_excluded_params``
+    курсор не принимается: такие выборки упорядочены по релевантности, а
+    ключ курсора — только поля ``cursor_ordering``.
+    """
+
+    cursor_pagination_class = KeysetPagination
+    cursor_excluded_params = ('search',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            if any(
+                request.query_params.get(param)
+                for param in self.cursor_excluded_params
+            ):
+                raise ValidationError(
+                    {
+                        'errors': 'Курсорная пагинация недоступна при '
+                        'поиске: используйте параметр page.'
+                    }
+                )
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
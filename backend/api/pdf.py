@@ -0,0 +1,241 @@
+import os
+import zlib
+from functools import lru_cache
+
+from reportlab.pdfbase.ttfonts import (
+    FF_NONSYMBOLIC,
+    FF_SYMBOLIC,
+    SUBSETN,
+    TTFont,
+    makeToUnicodeCMap,
+)
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 12
+LEADING = 16
+TITLE_FONT_SIZE = 14
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+SUBSET_SIZE = 256
+
+CATALOG_ID = 1
+PAGES_ID = 2
+RESOURCES_ID = 3
+FIRST_PAGE_ID = 4
+
+
+@lru_cache(maxsize=None)
+def load_font(path):
+    """Разобранный reportlab TrueType-шрифт; разбирается один раз."""
+    return TTFont(os.path.splitext(os.path.basename(path))[0], path)
+
+
+def pdf_object(object_id, body):
+    return f'{object_id} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+
+
+def pdf_stream(object_id, data, extra=''):
+    data = zlib.compress(data)
+    return (
+        (
+            f'{object_id} 0 obj\n<< /Length {len(data)} '
+            f'/Filter /FlateDecode{extra} >>\nstream\n'
+        ).encode('latin-1')
+        + data
+        + b'\nendstream\nendobj\n'
+    )
+
+
+def wrap(font, text, size):
+    """Разбивает строку по словам на строки не шире ``TEXT_WIDTH``."""
+    lines = []
+    line = ''
+    for word in text.split(' '):
+        candidate = f'{line} {word}' if line else word
+        if font.stringWidth(candidate, size) <= TEXT_WIDTH:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = ''
+        for char in word:
+            if font.stringWidth(line + char, size) > TEXT_WIDTH and line:
+                lines.append(line)
+                line = ''
+            line += char
+    lines.append(line)
+    return lines
+
+
+class StreamingPDFWriter:
+    """Пишет PDF постранично, выдавая байты по мере готовности страниц.
+
+    В памяти держится только текущая страница и таблица использованных
+    символов. Шрифт встраивается подмножествами по 256 символов (как это
+    делает reportlab): глифы подмножеств, ширины и ToUnicode пишутся в
+    конце, по фактически использованным символам. Страницы ссылаются на
+    общий словарь ресурсов, который тоже пишется в конце.
+    """
+
+    def __init__(self, font_path):
+        self.font = load_font(font_path)
+        self.subsets = []
+        self.codes = {}
+        self.offsets = {}
+        self.position = 0
+
+    def emit(self, object_id, data):
+        self.offsets[object_id] = self.position
+        self.position += len(data)
+        return data
+
+    def encode(self, text, size):
+        """Операторы вывода строки: по одному ``Tj`` на подмножество."""
+        runs = []
+        for char in text:
+            if char not in self.codes:
+                if not self.subsets or len(self.subsets[-1]) == SUBSET_SIZE:
+                    self.subsets.append([])
+                self.codes[char] = (
+                    len(self.subsets) - 1,
+                    len(self.subsets[-1]),
+                )
+                self.subsets[-1].append(ord(char))
+            subset, code = self.codes[char]
+            if runs and runs[-1][0] == subset:
+                runs[-1][1].append(code)
+            else:
+                runs.append((subset, [code]))
+        return ' '.join(
+            f'/F{subset} {size} Tf <{bytes(codes).hex()}> Tj'
+            for subset, codes in runs
+        )
+
+    def page(self, lines, object_id):
+        content = [
+            'BT',
+            f'{LEADING} TL',
+            f'{MARGIN} {PAGE_HEIGHT - MARGIN - FONT_SIZE} Td',
+        ]
+        content.extend(f'{self.encode(line, size)} T*' for line, size in lines)
+        content.append('ET')
+        yield self.emit(
+            object_id,
+            pdf_stream(object_id, '\n'.join(content).encode('latin-1')),
+        )
+        yield self.emit(
+            object_id + 1,
+            pdf_object(
+                object_id + 1,
+                f'<< /Type /Page /Parent {PAGES_ID} 0 R '
+                f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                f'/Resources {RESOURCES_ID} 0 R '
+                f'/Contents {object_id} 0 R >>',
+            ),
+        )
+
+    def fonts(self, first_id):
+        """Объекты шрифтов подмножеств и словарь ресурсов страниц."""
+        face = self.font.face
+        flags = face.flags & ~FF_NONSYMBOLIC | FF_SYMBOLIC
+        bbox = ' '.join(map(str, face.bbox))
+        fonts = []
+        for index, subset in enumerate(self.subsets):
+            font_id = first_id + 4 * index
+            name = f'{SUBSETN(index).decode()}+{self.font.fontName}'
+            widths = ' '.join(str(face.getCharWidth(code)) for code in subset)
+            fonts.append(f'/F{index} {font_id} 0 R')
+            yield self.emit(
+                font_id,
+                pdf_object(
+                    font_id,
+                    f'<< /Type /Font /Subtype /TrueType /BaseFont /{name} '
+                    f'/FirstChar 0 /LastChar {len(subset) - 1} '
+                    f'/Widths [{widths}] /FontDescriptor {font_id + 1} 0 R '
+                    f'/ToUnicode {font_id + 3} 0 R >>',
+                ),
+            )
+            yield self.emit(
+                font_id + 1,
+                pdf_object(
+                    font_id + 1,
+                    f'<< /Type /FontDescriptor /FontName /{name} '
+                    f'/Flags {flags} /FontBBox [{bbox}] '
+                    f'/ItalicAngle {face.italicAngle} /Ascent {face.ascent} '
+                    f'/Descent {face.descent} /CapHeight {face.capHeight} '
+                    f'/StemV {face.stemV} /FontFile2 {font_id + 2} 0 R >>',
+                ),
+            )
+            data = face.makeSubset(subset)
+            yield self.emit(
+                font_id + 2,
+                pdf_stream(font_id + 2, data, f' /Length1 {len(data)}'),
+            )
+            yield self.emit(
+                font_id + 3,
+                pdf_stream(
+                    font_id + 3,
+                    makeToUnicodeCMap(name, subset).encode('latin-1'),
+                ),
+            )
+        yield self.emit(
+            RESOURCES_ID,
+            pdf_object(RESOURCES_ID, f'<< /Font << {" ".join(fonts)} >> >>'),
+        )
+
+    def render(self, title, lines):
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(header)
+        yield header
+        page_ids = []
+        page_lines = [
+            (line, TITLE_FONT_SIZE)
+            for line in wrap(self.font, title, TITLE_FONT_SIZE)
+        ]
+        page_lines.append(('', FONT_SIZE))
+        for line in lines:
+            for part in wrap(self.font, line, FONT_SIZE):
+                page_lines.append((part, FONT_SIZE))
+                if len(page_lines) == LINES_PER_PAGE:
+                    page_ids.append(FIRST_PAGE_ID + 2 * len(page_ids))
+                    yield from self.page(page_lines, page_ids[-1])
+                    page_lines = []
+        if page_lines or not page_ids:
+            page_ids.append(FIRST_PAGE_ID + 2 * len(page_ids))
+            yield from self.page(page_lines, page_ids[-1])
+        yield from self.fonts(FIRST_PAGE_ID + 2 * len(page_ids))
+        kids = ' '.join(f'{page_id + 1} 0 R' for page_id in page_ids)
+        yield self.emit(
+            PAGES_ID,
+            pdf_object(
+                PAGES_ID,
+                f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>',
+            ),
+        )
+        yield self.emit(
+            CATALOG_ID,
+            pdf_object(
+                CATALOG_ID, f'<< /Type /Catalog /Pages {PAGES_ID} 0 R >>'
+            ),
+        )
+        size = max(self.offsets) + 1
+        xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        xref.extend(
+            f'{self.offsets[object_id]:010d} 00000 n \n'
+            for object_id in range(1, size)
+        )
+        xref.append(
+            f'trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\n'
+            f'startxref\n{self.position}\n%%EOF\n'
+        )
+        yield ''.join(xref).encode('latin-1')
+
+
+def render_pdf(title, lines, font_path):
+    """Выдает PDF со строками ``lines`` по частям, страница за страницей.
+
+    Длинные строки переносятся по ширине страницы.
+    """
+    return StreamingPDFWriter(font_path).render(title, lines)
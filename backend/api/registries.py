@@ -0,0 +1,131 @@
+import bisect
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+
+class ModelRegistry:
+    """Справочник в памяти процесса, загружаемый из БД один раз.
+
+    Актуальность сверяется с версией в общем кэше, поэтому сброс в одном
+    процессе перезагружает справочник и в остальных.
+    """
+
+    version_key = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, time.time_ns(), timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    @property
+    def data(self):
+        version = self.get_version()
+        data = self._data
+        if data is None or self._version != version:
+            with self._lock:
+                data = self._data = self.load()
+                self._version = version
+        return data
+
+    def invalidate(self):
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        self._data = None
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            self.get_version()
+
+
+class TagRegistry(ModelRegistry):
+    """Теги: сериализованный список и соответствие slug → id."""
+
+    version_key = 'tags:version'
+
+    def load(self):
+        tags = TagSerializer(Tag.objects.all(), many=True).data
+        ids_by_slug = {}
+        for tag in tags:
+            ids_by_slug.setdefault(tag['slug'], []).append(tag['id'])
+        return {
+            'list': [dict(tag) for tag in tags],
+            'by_id': {tag['id']: dict(tag) for tag in tags},
+            'ids_by_slug': ids_by_slug,
+        }
+
+    @property
+    def tags(self):
+        return self.data['list']
+
+    def get(self, pk):
+        return self.data['by_id'].get(pk)
+
+    def get_ids(self, slugs):
+        ids_by_slug = self.data['ids_by_slug']
+        return [pk for slug in slugs for pk in ids_by_slug.get(slug, ())]
+
+    def choices(self):
+        return [(slug, slug) for slug in self.data['ids_by_slug']]
+
+
+class IngredientRegistry(ModelRegistry):
+    """Ингредиенты, отсортированные по названию без учета регистра.
+
+    Поиск по началу названия — двоичный поиск по списку ключей
+    ``str.casefold``, который, в отличие от ``LIKE`` в SQLite, корректно
+    сравнивает кириллицу.
+    """
+
+    version_key = 'ingredients:version'
+
+    def load(self):
+        ingredients = sorted(
+            (
+                (ingredient['name'].casefold(), ingredient['id']),
+                dict(ingredient),
+            )
+            for ingredient in IngredientSerializer(
+                Ingredient.objects.all(), many=True
+            ).data
+        )
+        return {
+            'keys': [key for key, _ in ingredients],
+            'list': [ingredient for _, ingredient in ingredients],
+        }
+
+    @property
+    def ingredients(self):
+        return self.data['list']
+
+    def search(self, prefix, limit):
+        data = self.data
+        keys, ingredients = data['keys'], data['list']
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(keys, (prefix,))
+        result = []
+        for index in range(start, min(start + limit, len(keys))):
+            if not keys[index][0].startswith(prefix):
+                break
+            result.append(ingredients[index])
+        return result
+
+
+tag_registry = TagRegistry()
+ingredient_registry = IngredientRegistry()
@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import FavoriteRecipe, ShoppingCart
+from users.models import SubscribeUser
+
+RELATIONS_VERSION_KEY = 'relations:version:{}'
+RELATIONS_KEY = 'relations:{}:{}'
+
+
+def get_relations_version(user_id):
+    key = RELATIONS_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def load_relations(user_id):
+    return {
+        'favorites': set(
+            FavoriteRecipe.objects.filter(user_id=user_id).values_list(
+                'recipe_id', flat=True
+            )
+        ),
+        'cart': set(
+            ShoppingCart.objects.filter(user_id=user_id).values_list(
+                'recipe_id', flat=True
+            )
+        ),
+        'following': set(
+            SubscribeUser.objects.filter(user_id=user_id).values_list(
+                'author_id', flat=True
+            )
+        ),
+    }
+
+
+def get_relations(request):
+    """Множества id избранного, списка покупок и подписок пользователя.
+
+    Хранятся в кэше под ключом с версией пользователя: запись поднимает
+    версию, и набор, прочитанный до нее, больше не используется. В
+    пределах запроса результат запоминается на объекте запроса. Для
+    анонима возвращает ``None``.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    relations = getattr(request, '_relations', None)
+    if relations is None:
+        key = RELATIONS_KEY.format(user.pk, get_relations_version(user.pk))
+        relations = cache.get(key)
+        if relations is None:
+            relations = load_relations(user.pk)
+            cache.set(key, relations, settings.RELATIONS_CACHE_TIMEOUT)
+        request._relations = relations
+    return relations
+
+
+def has_relation(request, name, pk):
+    relations = get_relations(request)
+    return relations is not None and pk in relations[name]
+
+
+def invalidate_relations(user):
+    """Поднимает версию связей пользователя после фиксации транзакции."""
+    transaction.on_commit(lambda: _bump_relations_version(user.pk))
+
+
+def _bump_relations_version(user_id):
+    try:
+        cache.incr(RELATIONS_VERSION_KEY.format(user_id))
+    except ValueError:
+        get_relations_version(user_id)
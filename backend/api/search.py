@@ -0,0 +1,208 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from django.db import connection
+from django.db.models import BooleanField, Case, F, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+
+from recipes.models import Ingredient, Recipe
+
+INGREDIENT_FTS_TABLE = 'recipes_ingredient_fts'
+RECIPE_FTS_TABLE = 'recipes_recipe_fts'
+SEARCH_CONFIG = 'russian'
+TRIGRAM_LENGTH = 3
+
+
+# Таблицы FTS5 по базам данных: (alias, NAME) -> множество таблиц.
+_fts_tables = {}
+
+
+def fts_table_exists(table):
+    """Есть ли в SQLite таблица ``table``.
+
+    Список таблиц читается один раз на базу данных в процессе и
+    сбрасывается после миграций (``reset_fts_tables``).
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    tables = _fts_tables.get(key)
+    if tables is None:
+        tables = _fts_tables[key] = set(connection.introspection.table_names())
+    return table in tables
+
+
+def reset_fts_tables():
+    _fts_tables.clear()
+
+
+def get_trigrams(text):
+    return {
+        ''.join(trigram)
+        for trigram in zip(*(text[shift:] for shift in range(TRIGRAM_LENGTH)))
+    }
+
+
+def fts_quote(text):
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def search_ingredients_fuzzy(query, limit):
+    """Нечеткий поиск ингредиентов по триграммам.
+
+    Сначала идут совпадения по началу названия, затем остальные по
+    убыванию сходства. На PostgreSQL используется ``pg_trgm``, на SQLite —
+    таблица FTS5 с токенизатором ``trigram``. Возвращает ``None``, если
+    нечеткий поиск недоступен или запрос короче триграммы.
+    """
+    query = query.casefold()
+    if len(query) < TRIGRAM_LENGTH:
+        return None
+    if connection.vendor == 'postgresql':
+        return list(
+            Ingredient.objects.annotate(
+                normalized=Lower('name'),
+                similarity=TrigramSimilarity(Lower('name'), query),
+                is_prefix=Case(
+                    When(normalized__startswith=query, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                ),
+            )
+            .filter(
+                Q(normalized__trigram_similar=query)
+                | Q(normalized__startswith=query)
+            )
+            .order_by('-is_prefix', '-similarity', 'name', 'id')[:limit]
+        )
+    if not fts_table_exists(INGREDIENT_FTS_TABLE):
+        return None
+    match = ' OR '.join(fts_quote(trigram) for trigram in get_trigrams(query))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {INGREDIENT_FTS_TABLE} '
+            f'WHERE {INGREDIENT_FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+            (match, limit * 4),
+        )
+        ranks = {pk: rank for rank, (pk,) in enumerate(cursor.fetchall())}
+    ingredients = Ingredient.objects.in_bulk(ranks).values()
+    return sorted(
+        ingredients,
+        key=lambda ingredient: (
+            not ingredient.name.casefold().startswith(query),
+            ranks[ingredient.pk],
+            ingredient.name,
+        ),
+    )[:limit]
+
+
+def index_ingredient(ingredient):
+    if fts_table_exists(INGREDIENT_FTS_TABLE):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {INGREDIENT_FTS_TABLE} WHERE rowid = %s',
+                (ingredient.pk,),
+            )
+            cursor.execute(
+                f'INSERT INTO {INGREDIENT_FTS_TABLE}(rowid, name) '
+                'VALUES (%s, %s)',
+                (ingredient.pk, ingredient.name),
+            )
+
+
+def unindex_ingredient(ingredient):
+    if fts_table_exists(INGREDIENT_FTS_TABLE):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {INGREDIENT_FTS_TABLE} WHERE rowid = %s',
+                (ingredient.pk,),
+            )
+
+
+def rebuild_ingredient_index():
+    """Перестраивает таблицу FTS5 после массовой загрузки ингредиентов."""
+    if fts_table_exists(INGREDIENT_FTS_TABLE):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {INGREDIENT_FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {INGREDIENT_FTS_TABLE}(rowid, name) '
+                'SELECT id, name FROM recipes_ingredient'
+            )
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск по названию и описанию рецептов.
+
+    Результаты упорядочены по релевантности; название весит больше
+    описания. На PostgreSQL используется хранимый ``search_vector`` с
+    GIN-индексом, на SQLite — таблица FTS5.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', '-pub_date', '-id')
+        )
+    words = query.split()
+    if not words or not fts_table_exists(RECIPE_FTS_TABLE):
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        )
+    match = ' '.join(f'{fts_quote(word)}*' for word in words)
+    return (
+        queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT rowid FROM {RECIPE_FTS_TABLE} '
+                f'WHERE {RECIPE_FTS_TABLE} MATCH %s',
+                (match,),
+            )
+        )
+        .annotate(
+            rank=RawSQL(
+                f'SELECT bm25({RECIPE_FTS_TABLE}, 10.0, 1.0) '
+                f'FROM {RECIPE_FTS_TABLE} '
+                f'WHERE {RECIPE_FTS_TABLE} MATCH %s '
+                f'AND rowid = {Recipe._meta.db_table}.id',
+                (match,),
+                output_field=FloatField(),
+            )
+        )
+        .order_by('rank', '-pub_date', '-id')
+    )
+
+
+def index_recipe(recipe):
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk=recipe.pk).update(
+            search_vector=SearchVector(
+                'name', weight='A', config=SEARCH_CONFIG
+            )
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        )
+    elif fts_table_exists(RECIPE_FTS_TABLE):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {RECIPE_FTS_TABLE} WHERE rowid = %s',
+                (recipe.pk,),
+            )
+            cursor.execute(
+                f'INSERT INTO {RECIPE_FTS_TABLE}(rowid, name, text) '
+                'VALUES (%s, %s, %s)',
+                (recipe.pk, recipe.name, recipe.text),
+            )
+
+
+def unindex_recipe(recipe):
+    if fts_table_exists(RECIPE_FTS_TABLE):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {RECIPE_FTS_TABLE} WHERE rowid = %s',
+                (recipe.pk,),
+            )
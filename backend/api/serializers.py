@@ -1,19 +1,46 @@
+import json
+import posixpath
+
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.http import QueryDict
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator
-
-from foodgram_backend.constants import MAX_VALUE, MIN_VALUE
+from rest_framework.relations import MANY_RELATION_KWARGS
+from rest_framework.settings import api_settings
+
+from api.cache import invalidate_recipes
+from api.images import RENDITIONS, schedule_renditions
+from api.relations import has_relation, invalidate_relations
+from foodgram_backend.constants import (
+    MAX_BULK_RECIPES,
+    MAX_VALUE,
+    MIN_PK,
+    MIN_VALUE,
+)
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    RecipeTag,
     ShoppingCart,
+    ShoppingListItem,
     Tag,
 )
+from recipes.signals import cart_totals_suspended, cart_user_ids
 from users.models import SubscribeUser, User
 
 
+def get_recipes_limit(request):
+    """Значение ``recipes_limit`` из запроса или ``None``."""
+    try:
+        limit = int(request.GET['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+    return limit if limit >= 0 else None
+
+
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
@@ -29,18 +56,43 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return (
-            user.is_authenticated and obj.following.filter(user=user).exists()
-        )
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return has_relation(self.context['request'], 'following', obj.pk)
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """URL уменьшенных копий изображения рецепта.
+
+    Пока фоновая обработка не закончена, вместо копий отдается URL
+    оригинала.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for name in RENDITIONS:
+            path = recipe.renditions.get(name)
+            url = recipe.image.storage.url(path) if path else recipe.image.url
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[name] = url
+        return urls
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    images = ImageRenditionsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         read_only_fields = ('__all__',)
 
 
@@ -69,21 +121,62 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class AbstractFavoriteShoppingCartSerializer(serializers.ModelSerializer):
+class UniqueCreateMixin:
+    """Создание связи одним INSERT без предварительной проверки.
+
+    Повтор ловится ограничением уникальности в БД и возвращается как
+    обычная ошибка валидации с сообщением ``unique_message``. Другие
+    нарушения целостности (внешний ключ, проверочные ограничения) не
+    маскируются: после ошибки наличие пары ``unique_fields`` проверяется
+    заново.
+    """
+
+    unique_message = None
+    unique_fields = ()
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                instance = super().create(validated_data)
+        except IntegrityError:
+            if not self.Meta.model.objects.filter(
+                **{
+                    field: validated_data[field]
+                    for field in self.unique_fields
+                }
+            ).exists():
+                raise
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [self.unique_message]}
+            )
+        invalidate_relations(instance.user)
+        return instance
+
+
+class AbstractFavoriteShoppingCartSerializer(
+    UniqueCreateMixin, serializers.ModelSerializer
+):
+    unique_message = 'Пара user, recipe должны быть уникальными!'
+    unique_fields = ('user', 'recipe')
+
     class Meta:
         abstract = True
 
     def to_representation(self, instance):
         return ShortRecipeSerializer(instance.recipe, read_only=True).data
 
-    def validate(self, attrs):
-        if self.Meta.model.objects.filter(
-            user=attrs['user'], recipe=attrs['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Пара user, recipe должны быть уникальными!'
-            )
-        return attrs
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Сериализатор списка id рецептов для массовых операций"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=MIN_PK),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
 
 
 class FavoriteRecipeSerializer(AbstractFavoriteShoppingCartSerializer):
@@ -142,32 +235,32 @@ class SubscribeUserSerializer(UserSerializer):
         )
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
     def get_recipes(self, obj):
-        limit = self.context.get('request').GET.get('recipes_limit', None)
-        queryset = obj.recipes.all()
-        if limit:
-            try:
-                queryset = queryset[: int(limit)]
-            except ValueError:
-                pass
+        if hasattr(obj, 'latest_recipes'):
+            queryset = obj.latest_recipes
+        else:
+            queryset = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                queryset = queryset[:limit]
         return ShortRecipeSerializer(
             queryset, many=True, read_only=True, context=self.context
         ).data
 
 
-class CreateSubscribeUserSerializer(serializers.ModelSerializer):
+class CreateSubscribeUserSerializer(
+    UniqueCreateMixin, serializers.ModelSerializer
+):
+    unique_message = 'Вы уже подписаны на этого пользователя!'
+    unique_fields = ('user', 'author')
+
     class Meta:
         model = SubscribeUser
         fields = ('user', 'author')
-        validators = [
-            UniqueTogetherValidator(
-                queryset=SubscribeUser.objects.all(),
-                fields=('user', 'author'),
-                message='Вы уже подписаны на этого пользователя!',
-            ),
-        ]
 
     def validate(self, attrs):
         if attrs['user'] == attrs['author']:
@@ -190,6 +283,7 @@ class GetRecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    images = ImageRenditionsField()
 
     class Meta:
         model = Recipe
@@ -202,44 +296,117 @@ class GetRecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
         )
 
     def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        return (
-            user.is_authenticated
-            and user.recipes_favoriterecipe_user.filter(recipe=obj).exists()
-        )
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return has_relation(self.context['request'], 'favorites', obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        return (
-            user.is_authenticated
-            and user.recipes_shoppingcart_user.filter(recipe=obj).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return has_relation(self.context['request'], 'cart', obj.pk)
+
+
+def resolve_pks(queryset, pks):
+    """Возвращает объекты по списку id, загружая их одним запросом ``IN``.
+
+    Порядок и повторы сохраняются; об отсутствующих id сообщается
+    одной ошибкой.
+    """
+    objects = queryset.in_bulk(set(pks))
+    missing = [str(pk) for pk in dict.fromkeys(pks) if pk not in objects]
+    if missing:
+        raise serializers.ValidationError(
+            f'Объекты с id {", ".join(missing)} не существуют.'
         )
+    return [objects[pk] for pk in pks]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, разрешаемый одним запросом."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks = []
+        for item in data:
+            if isinstance(item, bool):
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(item).__name__
+                )
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(item).__name__
+                )
+        return resolve_pks(self.child_relation.get_queryset(), pks)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """``PrimaryKeyRelatedField``, который при ``many=True`` разрешает все
+    ключи одним запросом."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class BulkIngredientListSerializer(serializers.ListSerializer):
+    """Заменяет id ингредиентов объектами, загруженными одним запросом."""
+
+    def validate(self, attrs):
+        ingredients = resolve_pks(
+            Ingredient.objects.all(),
+            [ingredient['id'] for ingredient in attrs],
+        )
+        for ingredient, obj in zip(attrs, ingredients):
+            ingredient['id'] = obj
+        return attrs
 
 
 class CreateIngredientRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=MIN_VALUE, max_value=MAX_VALUE)
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
+        list_serializer_class = BulkIngredientListSerializer
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта: файл из multipart-запроса или строка base64."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            extension = posixpath.splitext(data.name)[1].lower()
+            data.name = f'{self.get_file_name(None)}{extension}'
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
 
 
 class PostRecipeSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all()
-    )
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     ingredients = CreateIngredientRecipeSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     cooking_time = serializers.IntegerField(
         min_value=MIN_VALUE, max_value=MAX_VALUE
     )
 
+    JSON_FORM_FIELDS = ('ingredients', 'tags')
+
     class Meta:
         model = Recipe
         fields = (
@@ -251,6 +418,23 @@ class PostRecipeSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    def to_internal_value(self, data):
+        # В multipart-запросе ингредиенты и теги приходят строками JSON.
+        if isinstance(data, QueryDict):
+            form, data = data, data.dict()
+            for field in self.JSON_FORM_FIELDS:
+                values = form.getlist(field)
+                if len(values) > 1:
+                    data[field] = values
+                elif isinstance(data.get(field), str):
+                    try:
+                        data[field] = json.loads(data[field])
+                    except ValueError:
+                        raise serializers.ValidationError(
+                            {field: ['Некорректный JSON.']}
+                        )
+        return super().to_internal_value(data)
+
     def check_unique_null_validate(self, list_obj, field):
         if not list_obj:
             raise serializers.ValidationError(
@@ -279,6 +463,9 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         return value
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_related(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return GetRecipeSerializer(instance, context=self.context).data
 
     @staticmethod
@@ -292,6 +479,7 @@ class PostRecipeSerializer(serializers.ModelSerializer):
             for ingredient in ingredients
         ]
         RecipeIngredient.objects.bulk_create(recipe_ingredient_objects)
+        invalidate_recipes(recipe.pk)
 
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
@@ -301,12 +489,93 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         )
         recipe.tags.set(tags)
         self.create_obj(recipe, ingredients)
+        schedule_renditions(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Приводит ингредиенты рецепта к новому списку по разнице.
+
+        Вставляются только новые строки, измененные количества
+        обновляются одним ``bulk_update``, лишние строки удаляются.
+        Возвращает изменения количеств ``{ingredient_id: delta}``.
+        """
+        current = {}
+        stale = []
+        amounts = {}
+        for row in recipe.recipes.all():
+            if row.ingredient_id in current:
+                stale.append(row)
+            else:
+                current[row.ingredient_id] = row
+        created = []
+        changed = []
+        for ingredient in ingredients:
+            pk = ingredient['id'].pk
+            row = current.pop(pk, None)
+            if row is None:
+                created.append(
+                    RecipeIngredient(
+                        recipe=recipe,
+                        ingredient_id=pk,
+                        amount=ingredient['amount'],
+                    )
+                )
+                amounts[pk] = ingredient['amount']
+            elif row.amount != ingredient['amount']:
+                amounts[pk] = ingredient['amount'] - row.amount
+                row.amount = ingredient['amount']
+                changed.append(row)
+        stale.extend(current.values())
+        for row in stale:
+            amounts[row.ingredient_id] = (
+                amounts.get(row.ingredient_id, 0) - row.amount
+            )
+        if stale:
+            RecipeIngredient.objects.filter(
+                pk__in=[row.pk for row in stale]
+            ).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if created:
+            RecipeIngredient.objects.bulk_create(created)
+        return amounts
+
+    @staticmethod
+    def update_tags(recipe, tags):
+        """Добавляет и удаляет только изменившиеся теги рецепта."""
+        current = dict(
+            RecipeTag.objects.filter(recipe=recipe).values_list('tag_id', 'pk')
+        )
+        tag_ids = {tag.pk for tag in tags}
+        removed = [
+            pk for tag_id, pk in current.items() if tag_id not in tag_ids
+        ]
+        if removed:
+            RecipeTag.objects.filter(pk__in=removed).delete()
+        added = tag_ids - current.keys()
+        if added:
+            RecipeTag.objects.bulk_create(
+                RecipeTag(recipe=recipe, tag_id=tag_id) for tag_id in added
+            )
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients', [])
-        self.validate_tags(validated_data.get('tags', []))
+        tags = validated_data.pop('tags', [])
+        self.validate_tags(tags)
+        if 'image' in validated_data:
+            validated_data['renditions'] = {}
         super().update(instance, validated_data)
-        instance.ingredients.clear()
-        self.create_obj(instance, ingredients)
+        if 'image' in validated_data:
+            schedule_renditions(instance)
+        self.update_tags(instance, tags)
+        # Списки покупок меняются один раз по разнице, а не сигналами на
+        # каждую строку.
+        with cart_totals_suspended():
+            amounts = self.update_ingredients(instance, ingredients)
+        ShoppingListItem.objects.add_amounts(
+            cart_user_ids(instance.pk), amounts
+        )
+        invalidate_recipes(instance.pk)
         return instance
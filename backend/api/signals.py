@@ -0,0 +1,122 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+)
+from django.dispatch import receiver
+
+from api.cache import invalidate_recipes
+from api.feed import backfill_author, fan_out_recipe, remove_author
+from api.registries import ingredient_registry, tag_registry
+from api.search import (
+    index_ingredient,
+    index_recipe,
+    reset_fts_tables,
+    unindex_ingredient,
+    unindex_recipe,
+)
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from users.models import SubscribeUser, User
+
+USER_PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        index_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    unindex_recipe(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created:
+        fan_out_recipe(instance)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+def recipe_relation_changed(sender, instance, **kwargs):
+    invalidate_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def recipe_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_recipes(instance.pk)
+    elif pk_set:
+        invalidate_recipes(*pk_set)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_registry_changed(sender, **kwargs):
+    tag_registry.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    invalidate_recipes(
+        *instance.tagsRecipes.values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_registry_changed(sender, **kwargs):
+    ingredient_registry.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, **kwargs):
+    index_ingredient(instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    unindex_ingredient(instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    invalidate_recipes(
+        *instance.ingredients.values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or USER_PUBLIC_FIELDS & set(update_fields):
+        invalidate_recipes(*instance.recipes.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=SubscribeUser)
+def subscribed(sender, instance, created, **kwargs):
+    if created:
+        backfill_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=SubscribeUser)
+def unsubscribed(sender, instance, **kwargs):
+    remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_migrate)
+def migrated(sender, **kwargs):
+    reset_fts_tables()
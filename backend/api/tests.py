@@ -0,0 +1,310 @@
+import itertools
+import threading
+import unittest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from api.cache import get_recipe_document_keys
+from api.exporters import pdf_font_exists
+from api.pdf import LINES_PER_PAGE, render_pdf
+from api.serializers import (
+    CreateSubscribeUserSerializer,
+    FavoriteRecipeSerializer,
+)
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+)
+from users.models import SubscribeUser, User
+
+# Число запросов не зависит от того, во скольких корзинах рецепт.
+PATCH_QUERIES = 26
+DELETE_QUERIES = 15
+
+
+class RelationToggleConcurrencyTest(TransactionTestCase):
+    """Параллельные повторы добавления и удаления связей."""
+
+    threads = 8
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', email='u@u.ru')
+        self.author = User.objects.create(username='author', email='a@a.ru')
+        self.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            text='Текст',
+            cooking_time=1,
+            image='recipes/images/test.png',
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=5
+        )
+
+    def run_parallel(self, method, url):
+        """Отправляет один и тот же запрос из нескольких потоков сразу
+        и возвращает коды ответов."""
+        barrier = threading.Barrier(self.threads)
+        codes = []
+
+        def worker():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                codes.append(getattr(client, method)(url).status_code)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=worker) for _ in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return sorted(codes)
+
+    def test_duplicate_favorite(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(
+            self.run_parallel('post', url), [201] + [400] * (self.threads - 1)
+        )
+        self.assertEqual(FavoriteRecipe.objects.count(), 1)
+        self.assertEqual(
+            self.run_parallel('delete', url),
+            [204] + [400] * (self.threads - 1),
+        )
+        self.assertFalse(FavoriteRecipe.objects.exists())
+
+    def test_duplicate_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(
+            self.run_parallel('post', url), [201] + [400] * (self.threads - 1)
+        )
+        self.assertEqual(SubscribeUser.objects.count(), 1)
+        self.assertEqual(
+            self.run_parallel('delete', url),
+            [204] + [400] * (self.threads - 1),
+        )
+        self.assertFalse(SubscribeUser.objects.exists())
+
+    def test_duplicate_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        self.assertEqual(
+            self.run_parallel('post', url), [201] + [400] * (self.threads - 1)
+        )
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.assertEqual(
+            list(
+                ShoppingListItem.objects.values_list(
+                    'user', 'ingredient', 'total_amount'
+                )
+            ),
+            [(self.user.pk, self.ingredient.pk, 5)],
+        )
+        self.assertEqual(
+            self.run_parallel('delete', url),
+            [204] + [400] * (self.threads - 1),
+        )
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+
+class RecipeIngredientsUpdateTest(TransactionTestCase):
+    """Изменение ингредиентов рецепта пересчитывает списки покупок."""
+
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='a@a.ru')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#000000', slug='breakfast'
+        )
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(7)
+        ]
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            text='Текст',
+            cooking_time=1,
+            image='recipes/images/test.png',
+        )
+        self.recipe.tags.set([self.tag])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=self.recipe, ingredient=ingredient, amount=10
+            )
+            for ingredient in self.ingredients[:6]
+        )
+        self.buyers = [
+            User.objects.create(
+                username=f'buyer{index}', email=f'{index}@b.ru'
+            )
+            for index in range(3)
+        ]
+        for buyer in self.buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.recipe)
+
+    def test_patch_amounts(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        # Пять количеств меняются, шестой ингредиент заменяется седьмым.
+        ingredients = [
+            {'id': ingredient.pk, 'amount': 20 + index}
+            for index, ingredient in enumerate(self.ingredients[:5])
+        ] + [{'id': self.ingredients[6].pk, 'amount': 3}]
+        with self.assertNumQueries(PATCH_QUERIES):
+            response = client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                {'ingredients': ingredients, 'tags': [self.tag.pk]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        expected = {item['id']: item['amount'] for item in ingredients}
+        for buyer in self.buyers:
+            self.assertEqual(
+                dict(
+                    ShoppingListItem.objects.filter(user=buyer).values_list(
+                        'ingredient', 'total_amount'
+                    )
+                ),
+                expected,
+            )
+
+
+class RecipeDeleteTest(TransactionTestCase):
+    """Удаление рецепта уменьшает итоги всех корзин разом."""
+
+    def setUp(self):
+        author = User.objects.create(username='author', email='a@a.ru')
+        self.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=author,
+                name=f'Рецепт {index}',
+                text='Текст',
+                cooking_time=1,
+                image='recipes/images/test.png',
+            )
+            for index in range(2)
+        ]
+        for amount, recipe in enumerate(self.recipes, start=1):
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=amount
+            )
+        self.buyers = [
+            User.objects.create(
+                username=f'buyer{index}', email=f'{index}@b.ru'
+            )
+            for index in range(5)
+        ]
+        for buyer in self.buyers:
+            for recipe in self.recipes:
+                ShoppingCart.objects.create(user=buyer, recipe=recipe)
+
+    def test_delete_recipe_in_carts(self):
+        with self.assertNumQueries(DELETE_QUERIES):
+            self.recipes[0].delete()
+        self.assertEqual(
+            sorted(
+                ShoppingListItem.objects.values_list('user', 'total_amount')
+            ),
+            [(buyer.pk, 2) for buyer in self.buyers],
+        )
+        self.assertEqual(ShoppingCart.objects.count(), len(self.buyers))
+
+
+class RecipeDocumentCacheTest(TransactionTestCase):
+    """Документ, собранный до изменения рецепта, не переживает сброс."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create(username='author', email='a@a.ru')
+        self.recipe = Recipe.objects.create(
+            author=author,
+            name='Старое название',
+            text='Текст',
+            cooking_time=1,
+            image='recipes/images/test.png',
+        )
+
+    def test_late_write_of_stale_document(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        client = APIClient()
+        # Читатель взял ключ и собрал документ до переименования...
+        key = get_recipe_document_keys([self.recipe.pk])[self.recipe.pk]
+        stale = client.get(url).data
+        cache.delete(key)
+        self.recipe.name = 'Новое'
+        self.recipe.save()
+        # ...и записал его уже после сброса.
+        cache.set(key, stale)
+        self.assertEqual(client.get(url).data['name'], 'Новое')
+
+
+class SearchCursorTest(TransactionTestCase):
+    """Поиск упорядочен по релевантности и не пагинируется курсором."""
+
+    def test_search_with_cursor(self):
+        client = APIClient()
+        response = client.get('/api/recipes/', {'search': 'суп', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data)
+        self.assertEqual(
+            client.get('/api/recipes/', {'search': 'суп'}).status_code, 200
+        )
+        self.assertEqual(
+            client.get('/api/recipes/', {'cursor': ''}).status_code, 200
+        )
+
+
+class UniqueCreateTest(TransactionTestCase):
+    """Ошибки целостности, не связанные с повтором, не выдаются за него."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', email='u@u.ru')
+
+    def test_self_follow_constraint(self):
+        with self.assertRaises(IntegrityError):
+            CreateSubscribeUserSerializer().create(
+                {'user': self.user, 'author': self.user}
+            )
+
+    def test_missing_recipe(self):
+        recipe = Recipe(pk=1000)
+        with self.assertRaises(IntegrityError):
+            FavoriteRecipeSerializer().create(
+                {'user': self.user, 'recipe': recipe}
+            )
+
+
+@unittest.skipUnless(pdf_font_exists(), 'Нет шрифта для PDF.')
+class StreamingPDFTest(unittest.TestCase):
+    """PDF выдается по страницам, не дожидаясь конца строк."""
+
+    def test_first_page_before_last_line(self):
+        lines = (f'Ингредиент {index}: 1 г' for index in itertools.count())
+        chunks = render_pdf('Список', lines, settings.SHOPPING_LIST_PDF_FONT)
+        header = next(chunks)
+        page = next(chunks)
+        self.assertTrue(header.startswith(b'%PDF-'))
+        self.assertIn(b'/FlateDecode', page)
+        # Бесконечный источник прочитан не дальше первой страницы.
+        self.assertLess(int(next(lines).split()[1][:-1]), 2 * LINES_PER_PAGE)
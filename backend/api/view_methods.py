@@ -1,7 +1,12 @@
-from django.http import FileResponse
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 
+from api.relations import invalidate_relations
+from api.serializers import RecipeIdsSerializer, ShortRecipeSerializer
+from recipes.models import Recipe
+
 
 def create_obj(serializer, data, context=None):
     save_serializer = serializer(data=data, context=context)
@@ -10,26 +15,68 @@ def create_obj(serializer, data, context=None):
     return Response(save_serializer.data, status=status.HTTP_201_CREATED)
 
 
-def create_file(request, ingredients):
-    first_name = request.user.first_name
-    last_name = request.user.last_name
-    text = f'Список покупок пользователя {first_name} {last_name}\n'
-    for ingredient in ingredients:
-        text += (
-            f'{ingredient["ingredient__name"]}: '
-            f'{ingredient["amount"]}'
-            f'{ingredient["ingredient__measurement_unit"]}\n'
+def create_file(request, ingredients, exporter):
+    rows = (
+        (
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['amount'],
         )
-    response = FileResponse(
-        text,
-        as_attachment=True,
-        content_type='text/plain',
+        for ingredient in ingredients.iterator()
+    )
+    response = StreamingHttpResponse(
+        exporter(request.user, rows), content_type=exporter.content_type
     )
+    filename = f'shopping_list.{exporter.extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
 
 
-def mapping_delete(queryset, message):
-    if queryset.exists():
-        queryset.delete()
+def mapping_delete(user, deleted, message, target):
+    """Ответ на удаление связи по числу удаленных строк: 204 или 400.
+
+    ``target`` — выборка объекта из URL: его наличие проверяется только
+    когда удалять было нечего, чтобы отличить 404 от 400. Кэш связей
+    пользователя сбрасывается только после удаления.
+    """
+    if deleted:
+        invalidate_relations(user)
         return Response(status=status.HTTP_204_NO_CONTENT)
+    if not target.exists():
+        raise Http404
     return Response({'errors': message}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def bulk_change(request, manager, add):
+    """Массово добавляет или удаляет рецепты пользователя.
+
+    Для каждого id возвращается итог операции и краткое представление
+    рецепта (``null``, если рецепта нет).
+    """
+    serializer = RecipeIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    recipes = Recipe.objects.in_bulk(ids)
+    with transaction.atomic():
+        if add:
+            changed = manager.bulk_add(request.user, list(recipes))
+            statuses = ('created', 'exists')
+        else:
+            changed = manager.bulk_remove(request.user, list(recipes))
+            statuses = ('deleted', 'not_in_list')
+    invalidate_relations(request.user)
+    changed = set(changed)
+    results = []
+    for pk in ids:
+        recipe = recipes.get(pk)
+        if recipe is None:
+            results.append({'id': pk, 'status': 'not_found', 'recipe': None})
+            continue
+        results.append(
+            {
+                'id': pk,
+                'status': statuses[0] if pk in changed else statuses[1],
+                'recipe': ShortRecipeSerializer(recipe).data,
+            }
+        )
+    return Response({'results': results}, status=status.HTTP_200_OK)
@@ -1,12 +1,35 @@
-from django.db.models import Sum
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db.models import (
+    BooleanField,
+    Count,
+    F,
+    Prefetch,
+    Value,
+    prefetch_related_objects,
+)
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as UVS
-from rest_framework import filters, permissions, viewsets
+from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.response import Response
 
-from api.filters import AuthorAndTagFilter, IngredientFilter
+from api.cache import (
+    cache_anonymous_response,
+    get_cache_stats,
+    reset_cache_stats,
+)
+from api.documents import render_recipes
+from api.exporters import get_exporter
+from api.feed import FeedPagination
+from api.filters import AuthorAndTagFilter
+from api.pagination import OptionalCursorPagination
 from api.permissions import IsAuthorizedOwnerOrReadOnly
+from api.registries import ingredient_registry, tag_registry
+from api.search import search_ingredients_fuzzy
 from api.serializers import (
     CreateSubscribeUserSerializer,
     FavoriteRecipeSerializer,
@@ -16,14 +39,20 @@ from api.serializers import (
     ShoppingCartSerializer,
     SubscribeUserSerializer,
     TagSerializer,
+    get_recipes_limit,
+)
+from api.view_methods import (
+    bulk_change,
+    create_file,
+    create_obj,
+    mapping_delete,
 )
-from api.view_methods import create_file, create_obj, mapping_delete
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
     Recipe,
-    RecipeIngredient,
     ShoppingCart,
+    ShoppingListItem,
     Tag,
 )
 from users.models import SubscribeUser, User
@@ -34,25 +63,50 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return Response(tag_registry.tags)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            tag = tag_registry.get(int(kwargs[self.lookup_field]))
+        except ValueError:
+            tag = None
+        if tag is None:
+            raise Http404
+        return Response(tag)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return Response(ingredient_registry.ingredients)
+        if request.query_params.get('mode') == 'fuzzy':
+            ingredients = search_ingredients_fuzzy(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            )
+            if ingredients is not None:
+                return Response(
+                    self.get_serializer(ingredients, many=True).data
+                )
+        return Response(
+            ingredient_registry.search(name, settings.INGREDIENT_SEARCH_LIMIT)
+        )
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = (
-        Recipe.objects.all()
-        .select_related('author')
-        .prefetch_related('tags', 'ingredients')
-    )
+    queryset = Recipe.objects.all()
     filter_backends = (filters.OrderingFilter, DjangoFilterBackend)
     filterset_class = AuthorAndTagFilter
     permission_classes = (IsAuthorizedOwnerOrReadOnly,)
+    pagination_class = OptionalCursorPagination
+    parser_classes = (JSONParser, MultiPartParser)
     ordering = ('-pub_date',)
+    cursor_ordering = ('-pub_date', '-id')
     http_method_names = (
         'get',
         'post',
@@ -60,6 +114,43 @@ class RecipeViewSet(viewsets.ModelViewSet):
         'delete',
     )
 
+    @cache_anonymous_response
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_recipes(page, request))
+        return Response(render_recipes(queryset, request))
+
+    @cache_anonymous_response
+    def retrieve(self, request, *args, **kwargs):
+        data = render_recipes([self.get_object()], request)
+        if not data:
+            # Рецепт удалили между выборкой и сборкой документа.
+            raise Http404
+        return Response(data[0])
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Файлы из multipart-запроса пишутся на диск частями, а не
+        # собираются в памяти.
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def perform_content_negotiation(self, request, force=False):
+        # У выгрузки списка покупок параметр format выбирает формат файла,
+        # а не рендерер DRF.
+        return super().perform_content_negotiation(
+            request, force=force or self.action == 'download_shopping_cart'
+        )
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            # Поисковый вектор нужен только в условиях, в ответ он не
+            # попадает.
+            queryset = queryset.defer('search_vector')
+        return queryset
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return GetRecipeSerializer
@@ -73,27 +164,58 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @favorite.mapping.delete
     def del_favorite(self, request, pk=None):
-        get_object_or_404(Recipe, pk=pk)
         return mapping_delete(
-            FavoriteRecipe.objects.filter(user=request.user, recipe_id=pk),
+            request.user,
+            FavoriteRecipe.objects.bulk_remove(request.user, [pk]),
             'Этот рецепт не добавлен в избранное!',
+            Recipe.objects.filter(pk=pk),
         )
 
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request):
+        page = self.paginate_queryset(
+            Recipe.objects.only('pub_date', 'author_id')
+        )
+        return self.get_paginated_response(render_recipes(page, request))
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def bulk_favorite(self, request):
+        return bulk_change(request, FavoriteRecipe.objects, add=True)
+
+    @bulk_favorite.mapping.delete
+    def del_bulk_favorite(self, request):
+        return bulk_change(request, FavoriteRecipe.objects, add=False)
+
     @action(
         methods=['GET'],
         detail=False,
         permission_classes=(permissions.IsAuthenticatedOrReadOnly,),
     )
     def download_shopping_cart(self, request):
+        exporter = get_exporter(request.query_params.get('format', 'txt'))
+        if exporter is None:
+            return Response(
+                {'errors': 'Этот формат списка покупок не поддерживается!'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         ingredients = (
-            RecipeIngredient.objects.filter(
-                recipe__recipes_shoppingcart_recipe__user=request.user
+            ShoppingListItem.objects.filter(user=request.user)
+            .annotate(amount=F('total_amount'))
+            .values(
+                'ingredient__name', 'ingredient__measurement_unit', 'amount'
             )
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount=Sum('amount'))
             .order_by('ingredient__name')
         )
-        return create_file(request, ingredients)
+        return create_file(request, ingredients, exporter)
 
     @action(methods=['POST'], detail=True)
     def shopping_cart(self, request, pk=None):
@@ -103,14 +225,43 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @shopping_cart.mapping.delete
     def del_shopping_cart(self, request, pk=None):
-        get_object_or_404(Recipe, pk=pk)
         return mapping_delete(
-            ShoppingCart.objects.filter(user=request.user, recipe_id=pk),
+            request.user,
+            ShoppingCart.objects.bulk_remove(request.user, [pk]),
             'Этот рецепт не добавлен в ваш список покупок!',
+            Recipe.objects.filter(pk=pk),
         )
 
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def bulk_shopping_cart(self, request):
+        return bulk_change(request, ShoppingCart.objects, add=True)
+
+    @bulk_shopping_cart.mapping.delete
+    def del_bulk_shopping_cart(self, request):
+        return bulk_change(request, ShoppingCart.objects, add=False)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(permissions.IsAdminUser,),
+    )
+    def cache_stats(self, request):
+        return Response(get_cache_stats(), status=status.HTTP_200_OK)
+
+    @cache_stats.mapping.delete
+    def reset_cache_stats(self, request):
+        reset_cache_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class UserViewSet(UVS):
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('username', 'id')
+
     def get_permissions(self):
         if self.action == 'me':
             return (permissions.IsAuthenticated(),)
@@ -131,10 +282,13 @@ class UserViewSet(UVS):
 
     @subscribe.mapping.delete
     def del_subscribe(self, request, id=None):
-        get_object_or_404(User, pk=id)
         return mapping_delete(
-            SubscribeUser.objects.filter(user=request.user, author__id=id),
+            request.user,
+            SubscribeUser.objects.filter(
+                user=request.user, author_id=id
+            ).delete()[0],
             'Вы не подписаны на этого пользователя!',
+            User.objects.filter(pk=id),
         )
 
     @action(
@@ -142,8 +296,22 @@ class UserViewSet(UVS):
         detail=False,
     )
     def subscriptions(self, request):
-        data = User.objects.filter(following__user=request.user)
+        data = (
+            User.objects.filter(following__user=request.user)
+            .annotate(
+                recipes_count=Count('recipes'),
+                is_subscribed=Value(True, output_field=BooleanField()),
+            )
+            .order_by('username', 'id')
+        )
         page = self.paginate_queryset(data)
+        recipes = Recipe.objects.filter(author__in=page)
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes.latest_per_author(limit)
+        prefetch_related_objects(
+            page, Prefetch('recipes', recipes, to_attr='latest_recipes')
+        )
         serializer = SubscribeUserSerializer(
             page, many=True, context={'request': request}
         )
@@ -4,3 +4,5 @@ LIMITATION_CHARACTERS_NAME = 200
 LIMITATION_CHARACTERS_COLOR = 7
 MIN_VALUE = 1
 MAX_VALUE = 10000
+MIN_PK = 1
+MAX_BULK_RECIPES = 100
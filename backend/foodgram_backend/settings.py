@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'drf_yasg',
     'rest_framework',
     'rest_framework.authtoken',
@@ -75,6 +76,10 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+APPROXIMATE_COUNT_THRESHOLD = int(
+    os.getenv('APPROXIMATE_COUNT_THRESHOLD', 10000)
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
@@ -106,8 +111,49 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Файловая тестовая база: в общей in-memory базе параллельные
+            # соединения получают «table is locked» без ожидания.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+# Общий для процессов кэш: документы рецептов, связи пользователей,
+# страницы ответов и счетчики попаданий (incr в memcached атомарен).
+if os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.getenv('MEMCACHED_LOCATION'),
         }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 300))
+
+RECIPE_DOCUMENT_TIMEOUT = int(os.getenv('RECIPE_DOCUMENT_TIMEOUT', 86400))
+
+RELATIONS_CACHE_TIMEOUT = int(os.getenv('RELATIONS_CACHE_TIMEOUT', 3600))
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', 50))
+
+FEED_MAX_ENTRIES = int(os.getenv('FEED_MAX_ENTRIES', 1000))
+
+FEED_POPULAR_AUTHORS_TIMEOUT = 300
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -0,0 +1,89 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.storage import recipe_image_storage
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы изображений рецептов, на которые не ссылается ни '
+        'один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=24,
+            help=(
+                'Не трогать файлы моложе указанного числа часов: они могут '
+                'принадлежать еще не сохраненному рецепту.'
+            ),
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы, которые будут удалены.',
+        )
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        upload_to = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        if not storage.exists(upload_to):
+            return
+        renditions = set()
+        for value in Recipe.objects.values_list(
+            'renditions', flat=True
+        ).iterator():
+            renditions.update(value.values())
+        deadline = timezone.now() - timedelta(hours=options['min_age'])
+        deleted = 0
+        batch = []
+        for name in walk(storage, upload_to):
+            if (
+                name in renditions
+                or storage.get_modified_time(name) > deadline
+            ):
+                continue
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                deleted += self.delete_orphans(storage, batch, options)
+                batch = []
+        if batch:
+            deleted += self.delete_orphans(storage, batch, options)
+        if options['dry_run']:
+            result = f'would delete {deleted}'
+        else:
+            result = f'deleted {deleted}'
+        self.stdout.write(
+            'Collect media garbage\t\t'
+            + '\033[32m{}'.format(result)
+            + '\033[0m'
+        )
+
+    def delete_orphans(self, storage, names, options):
+        referenced = set(
+            Recipe.objects.filter(image__in=names).values_list(
+                'image', flat=True
+            )
+        )
+        orphans = [name for name in names if name not in referenced]
+        for name in orphans:
+            if options['dry_run']:
+                self.stdout.write(f'would delete {name}')
+            else:
+                storage.delete(name)
+        return len(orphans)
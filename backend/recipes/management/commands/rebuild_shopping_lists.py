@@ -0,0 +1,88 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает сохраненные итоги списков покупок и сверяет их '
+        'с расчетом по рецептам в корзинах.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить итоги, ничего не меняя.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def get_mismatches(self):
+        live = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in (
+                ShoppingListItem.objects.live_totals().iterator()
+            )
+        }
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in (
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                ).iterator()
+            )
+        }
+        return {
+            key: (stored.get(key), live.get(key))
+            for key in live.keys() | stored.keys()
+            if stored.get(key) != live.get(key)
+        }
+
+    def rebuild(self, batch_size):
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total,
+                    )
+                    for user_id, ingredient_id, total in (
+                        ShoppingListItem.objects.live_totals().iterator()
+                    )
+                ),
+                batch_size=batch_size,
+            )
+
+    def handle(self, *args: Any, **options: Any):
+        if not options['verify']:
+            self.rebuild(options['batch_size'])
+            self.stdout.write(
+                'Rebuild shopping lists\t\t'
+                + '\033[32m{}'.format('OK')
+                + '\033[0m'
+            )
+        mismatches = self.get_mismatches()
+        for (user_id, ingredient_id), (stored, live) in sorted(
+            mismatches.items()
+        ):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'stored={stored} live={live}'
+            )
+        if mismatches:
+            self.stdout.write(
+                'Verify shopping lists\t\t'
+                + '\033[31m{}'.format(f'{len(mismatches)} mismatches')
+                + '\033[0m'
+            )
+        else:
+            self.stdout.write(
+                'Verify shopping lists\t\t'
+                + '\033[32m{}'.format('OK')
+                + '\033[0m'
+            )
@@ -1,46 +1,270 @@
 import csv
+import io
+import json
 import os
+import time
+from itertools import islice
 from typing import Any
 
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 
-from recipes.models import Ingredient, Tag
+from api.cache import invalidate_recipes, is_cache_shared
+from api.registries import ingredient_registry, tag_registry
+from api.search import rebuild_ingredient_index
+from recipes.models import Ingredient, RecipeTag, Tag
+
+STAGING_TABLE = 'upload_staging'
+
+
+def iter_json_array(file, chunk_size=65536):
+    """Построчно читает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('Ожидался JSON-массив.')
+            started = True
+            position += 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield row
+        position = end
+
+
+def read_rows(path, fields):
+    """Строки файла ``.csv`` или ``.json`` как словари из ``fields``."""
+    with open(path, 'r', encoding='UTF-8') as file:
+        if path.endswith('.json'):
+            rows = iter_json_array(file)
+        else:
+            rows = csv.DictReader(file)
+        for row in rows:
+            yield {field: row[field] for field in fields}
 
 
 class Command(BaseCommand):
-    def upload(self, data, model):
-        models = []
-        for row in data:
-            models.append(model(**row))
-        return model.objects.bulk_create(models)
+    help = (
+        'Загружает ингредиенты и теги из каталога data. По умолчанию '
+        'справочники заменяются целиком, с --upsert новые записи '
+        'добавляются, а измененные обновляются без удаления.'
+    )
+
+    # Модель: (файл по умолчанию, ключ, поля).
+    sources = {
+        Ingredient: (
+            'ingredients.csv',
+            ('name', 'measurement_unit'),
+            ('name', 'measurement_unit'),
+        ),
+        Tag: ('tags.csv', ('slug',), ('name', 'color', 'slug')),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Не удалять данные: добавить новые и обновить измененные.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients',
+            default='ingredients.csv',
+            help='Файл ингредиентов в data: .csv или .json.',
+        )
 
     def handle(self, *args: Any, **options: Any):
-        path = os.getcwd() + '/data'
-        if 'ingredients.csv' and 'tags.csv' not in os.listdir(path):
-            raise FileNotFoundError(
-                'Файл ingredients.csv или tags.csv не найден!'
-            )
-        Ingredient.objects.all().delete()
-        Tag.objects.all().delete()
+        path = os.path.join(os.getcwd(), 'data')
+        files = {
+            Ingredient: os.path.join(path, options['ingredients']),
+            Tag: os.path.join(path, self.sources[Tag][0]),
+        }
+        for filename in files.values():
+            if not os.path.exists(filename):
+                raise FileNotFoundError(f'Файл {filename} не найден!')
+        if not options['upsert']:
+            Ingredient.objects.all().delete()
+            Tag.objects.all().delete()
         try:
-            for filename in os.listdir(path):
-                with open(
-                    os.path.join(path, filename), 'r', encoding='UTF-8'
-                ) as file:
-                    file_reader = csv.DictReader(file)
-                    if filename == 'ingredients.csv':
-                        self.upload(file_reader, Ingredient)
-                        self.stdout.write(
-                            'Upload Ingredients\t\t'
-                            + '\033[32m{}'.format('OK')
-                            + '\033[0m'
-                        )
-                    elif filename == 'tags.csv':
-                        self.upload(file_reader, Tag)
-                        self.stdout.write(
-                            'upload tags\t\t'
-                            + '\033[32m{}'.format('OK')
-                            + '\033[0m'
-                        )
+            for model, filename in files.items():
+                self.load(model, filename, options['batch_size'])
         except IOError as error:
             raise IOError(f'Ошибка открытия файла: {error}')
+        rebuild_ingredient_index()
+        ingredient_registry.invalidate()
+        tag_registry.invalidate()
+        if not is_cache_shared():
+            self.stdout.write(
+                'Reset cache\t\t'
+                + '\033[33m{}'.format(
+                    'кэш в памяти сервера не сброшен: перезапустите '
+                    'сервер или задайте MEMCACHED_LOCATION'
+                )
+                + '\033[0m'
+            )
+
+    def load(self, model, filename, batch_size):
+        _, key, fields = self.sources[model]
+        rows = read_rows(filename, fields)
+        upsert = (
+            self.upsert_copy
+            if connection.vendor == 'postgresql'
+            else self.upsert_batch
+        )
+        total = inserted = changed = duplicates = 0
+        started = time.monotonic()
+        if connection.vendor == 'postgresql':
+            self.create_staging_table(fields)
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    batch_inserted, batch_changed = upsert(
+                        model, key, fields, batch
+                    )
+                total += len(batch)
+                duplicates += len(batch) - len(
+                    {tuple(row[field] for field in key) for row in batch}
+                )
+                inserted += batch_inserted
+                changed += batch_changed
+        finally:
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Upload {model._meta.verbose_name_plural}\t\t'
+            + '\033[32m{}'.format('OK')
+            + '\033[0m'
+            + f'\n  {total} строк за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} строк/с): '
+            f'добавлено {inserted}, изменено {changed}, '
+            f'повторов в файле {duplicates}, '
+            f'без изменений {total - inserted - changed - duplicates}'
+        )
+
+    def upsert_batch(self, model, key, fields, batch):
+        """Сверяет пачку с базой и пишет только отличия."""
+        rows = {tuple(row[field] for field in key): row for row in batch}
+        existing = {}
+        for obj in model.objects.filter(
+            **{f'{key[0]}__in': {row_key[0] for row_key in rows}}
+        ):
+            existing.setdefault(
+                tuple(getattr(obj, field) for field in key), obj
+            )
+        updatable = [field for field in fields if field not in key]
+        created = []
+        changed = []
+        for row_key, row in rows.items():
+            obj = existing.get(row_key)
+            if obj is None:
+                created.append(model(**row))
+            elif any(getattr(obj, field) != row[field] for field in updatable):
+                for field in updatable:
+                    setattr(obj, field, row[field])
+                changed.append(obj)
+        # ignore_conflicts молча пропускает строки, вставленные в обход
+        # сверки, поэтому добавленные считаются по строкам в базе.
+        lookup = {f'{key[0]}__in': {getattr(obj, key[0]) for obj in created}}
+        before = model.objects.filter(**lookup).count() if created else 0
+        model.objects.bulk_create(created, ignore_conflicts=True)
+        inserted = (
+            model.objects.filter(**lookup).count() - before if created else 0
+        )
+        if changed:
+            model.objects.bulk_update(changed, updatable)
+            self.invalidate_changed(model, [obj.pk for obj in changed])
+        return inserted, len(changed)
+
+    def create_staging_table(self, fields):
+        columns = ', '.join(
+            f'{connection.ops.quote_name(field)} text' for field in fields
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE}')
+            cursor.execute(f'CREATE TEMP TABLE {STAGING_TABLE} ({columns})')
+
+    def upsert_copy(self, model, key, fields, batch):
+        """Загружает пачку через ``COPY`` во временную таблицу и сливает
+        ее с основной двумя запросами."""
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        columns = ', '.join(quote(field) for field in fields)
+        key_columns = ', '.join(quote(field) for field in key)
+        match = ' AND '.join(
+            f'target.{quote(field)} = staging.{quote(field)}' for field in key
+        )
+        updatable = [field for field in fields if field not in key]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [row[field] for field in fields] for row in batch
+        )
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} ({columns}) FROM STDIN '
+                'WITH (FORMAT csv)',
+                buffer,
+            )
+            distinct = (
+                f'SELECT DISTINCT ON ({key_columns}) {columns} '
+                f'FROM {STAGING_TABLE}'
+            )
+            changed = 0
+            if updatable:
+                cursor.execute(
+                    f'UPDATE {table} AS target SET '
+                    + ', '.join(
+                        f'{quote(field)} = staging.{quote(field)}'
+                        for field in updatable
+                    )
+                    + f' FROM ({distinct}) AS staging WHERE {match} AND ('
+                    + ' OR '.join(
+                        f'target.{quote(field)} IS DISTINCT FROM '
+                        f'staging.{quote(field)}'
+                        for field in updatable
+                    )
+                    + ') RETURNING target.id'
+                )
+                changed_ids = [row[0] for row in cursor.fetchall()]
+                changed = len(changed_ids)
+                self.invalidate_changed(model, changed_ids)
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM ({distinct}) AS staging '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {table} AS target '
+                f'WHERE {match}) ON CONFLICT DO NOTHING'
+            )
+            inserted = cursor.rowcount
+        return inserted, changed
+
+    @staticmethod
+    def invalidate_changed(model, pks):
+        if model is Tag and pks:
+            invalidate_recipes(
+                *RecipeTag.objects.filter(tag_id__in=pks).values_list(
+                    'recipe_id', flat=True
+                )
+            )
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_auto_20240129_2312'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipetag',
+            index=models.Index(fields=['tag', 'recipe'], name='recipes_recipetag_tag_recipe'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+POSTGRES_FORWARDS = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (lower(name) gin_trgm_ops)',
+)
+POSTGRES_BACKWARDS = ('DROP INDEX IF EXISTS recipes_ingredient_name_trgm',)
+SQLITE_FORWARDS = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_ingredient_fts '
+    'USING fts5(name, tokenize="trigram")',
+    'INSERT INTO recipes_ingredient_fts(rowid, name) '
+    'SELECT id, name FROM recipes_ingredient',
+)
+SQLITE_BACKWARDS = ('DROP TABLE IF EXISTS recipes_ingredient_fts',)
+
+
+def execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_FORWARDS)
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = {row[0] for row in cursor.fetchall()}
+            cursor.execute('SELECT sqlite_version()')
+            version = tuple(map(int, cursor.fetchone()[0].split('.')))
+        if 'ENABLE_FTS5' in options and version >= (3, 34):
+            execute(schema_editor, SQLITE_FORWARDS)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_BACKWARDS)
+    elif vendor == 'sqlite':
+        execute(schema_editor, SQLITE_BACKWARDS)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('recipes', '0007_recipetag_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
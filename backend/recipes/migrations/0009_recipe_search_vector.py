@@ -0,0 +1,63 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:50
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARDS = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+    'ON recipes_recipe USING gin (search_vector)',
+    "UPDATE recipes_recipe SET search_vector = "
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')",
+)
+POSTGRES_BACKWARDS = ('DROP INDEX IF EXISTS recipes_recipe_search_vector',)
+SQLITE_FORWARDS = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts '
+    'USING fts5(name, text)',
+    'INSERT INTO recipes_recipe_fts(rowid, name, text) '
+    'SELECT id, name, text FROM recipes_recipe',
+)
+SQLITE_BACKWARDS = ('DROP TABLE IF EXISTS recipes_recipe_fts',)
+
+
+def execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_FORWARDS)
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = {row[0] for row in cursor.fetchall()}
+        if 'ENABLE_FTS5' in options:
+            execute(schema_editor, SQLITE_FORWARDS)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_BACKWARDS)
+    elif vendor == 'sqlite':
+        execute(schema_editor, SQLITE_BACKWARDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_ingredient_trigram_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name='Поисковый вектор'
+            ),
+        ),
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные копии изображения'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_feedentry_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='recipes_shoppingcart_recipe', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+    ]
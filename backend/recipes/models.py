@@ -1,9 +1,13 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from foodgram_backend import constants
-from users.models import User
+from recipes.storage import recipe_image_storage
+from users.models import SubscribeUser, User
 
 
 class Ingredient(models.Model):
@@ -48,6 +52,93 @@ class Tag(models.Model):
         return self.name
 
 
+def ranked_pks(queryset, partition_by, order_by, operator, limit):
+    """Подзапрос с id строк, отобранных по номеру внутри группы.
+
+    Строки нумеруются ``ROW_NUMBER() OVER (PARTITION BY ...)``, а номер
+    сравнивается с ``limit`` оператором ``operator`` уже во внешнем
+    запросе: Django 3.2 не умеет фильтровать по оконным функциям.
+    """
+    numbered = (
+        queryset.annotate(
+            row_number=models.Window(
+                RowNumber(),
+                partition_by=models.F(partition_by),
+                order_by=order_by,
+            )
+        )
+        .order_by()
+        .values('pk', 'row_number')
+    )
+    sql, params = numbered.query.sql_with_params()
+    quote = connections[queryset.db].ops.quote_name
+    return RawSQL(
+        f'SELECT {quote("id")} FROM ({sql}) {quote("numbered")} '
+        f'WHERE {quote("row_number")} {operator} %s',
+        (*params, limit),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами пользователя: избранное и список
+        покупок."""
+        if not user.is_authenticated:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                FavoriteRecipe.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+        )
+
+    def latest_per_author(self, limit):
+        """Не более ``limit`` последних рецептов каждого автора."""
+        return self.filter(
+            pk__in=ranked_pks(
+                self,
+                'author_id',
+                (models.F('pub_date').desc(), models.F('pk').desc()),
+                '<=',
+                limit,
+            )
+        )
+
+    def with_related(self, user):
+        """Подгружает теги, ингредиенты и автора с флагом подписки."""
+        if user.is_authenticated:
+            is_subscribed = models.Exists(
+                SubscribeUser.objects.filter(
+                    user=user, author=models.OuterRef('pk')
+                )
+            )
+        else:
+            is_subscribed = models.Value(
+                False, output_field=models.BooleanField()
+            )
+        return self.prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipes',
+                queryset=RecipeIngredient.objects.select_related('ingredient'),
+            ),
+            models.Prefetch(
+                'author',
+                queryset=User.objects.annotate(is_subscribed=is_subscribed),
+            ),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -58,7 +149,9 @@ class Recipe(models.Model):
     name = models.CharField(
         'Название рецепта', max_length=constants.LIMITATION_CHARACTERS_NAME
     )
-    image = models.ImageField('Изображение', upload_to='recipes/')
+    image = models.ImageField(
+        'Изображение', upload_to='recipes/', storage=recipe_image_storage
+    )
     text = models.TextField('Описание рецепта')
     tags = models.ManyToManyField(Tag, through='RecipeTag')
     ingredients = models.ManyToManyField(
@@ -80,6 +173,14 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'Дата и время добавления', auto_now_add=True, db_index=True
     )
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False
+    )
+    renditions = models.JSONField(
+        'Уменьшенные копии изображения', default=dict, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -107,6 +208,11 @@ class RecipeTag(models.Model):
     class Meta:
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецептов'
+        indexes = (
+            models.Index(
+                fields=('tag', 'recipe'), name='recipes_recipetag_tag_recipe'
+            ),
+        )
 
     def __str__(self) -> str:
         return f'Рецепт: {self.recipe}, Тег: {self.tag}'
@@ -144,6 +250,86 @@ class RecipeIngredient(models.Model):
         )
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    def _returning(self, sql, user, recipe_ids):
+        """Выполняет запрос с ``RETURNING`` и возвращает id рецептов."""
+        if not recipe_ids:
+            return []
+        opts = self.model._meta
+        quote_name = connections[self.db].ops.quote_name
+        sql = sql.format(
+            table=quote_name(opts.db_table),
+            recipes=quote_name(Recipe._meta.db_table),
+            user=opts.get_field('user').column,
+            recipe=opts.get_field('recipe').column,
+            placeholders=', '.join(['%s'] * len(recipe_ids)),
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, [user.pk, *recipe_ids])
+            return [row[0] for row in cursor.fetchall()]
+
+    def bulk_add(self, user, recipe_ids):
+        """Добавляет рецепты пользователю одним INSERT.
+
+        Возвращает id рецептов, строки которых действительно вставлены:
+        уже существующие пропускает ``ON CONFLICT DO NOTHING``, а
+        удаленные к этому моменту рецепты отсекает выборка.
+        """
+        return self._returning(
+            'INSERT INTO {table} ({user}, {recipe}) '
+            'SELECT %s, id FROM {recipes} WHERE id IN ({placeholders}) '
+            'ON CONFLICT DO NOTHING RETURNING {recipe}',
+            user,
+            recipe_ids,
+        )
+
+    def bulk_remove(self, user, recipe_ids):
+        """Удаляет рецепты пользователя одним DELETE; возвращает id
+        удаленных."""
+        return self._returning(
+            'DELETE FROM {table} WHERE {user} = %s '
+            'AND {recipe} IN ({placeholders}) RETURNING {recipe}',
+            user,
+            recipe_ids,
+        )
+
+
+class ShoppingCartQuerySet(UserRecipeQuerySet):
+    # Запросы в обход ORM не отправляют сигналы, поэтому итоги списка
+    # покупок пересчитываются здесь одним изменением на все рецепты.
+    def bulk_add(self, user, recipe_ids):
+        with transaction.atomic(using=self.db):
+            added = super().bulk_add(user, recipe_ids)
+            ShoppingListItem.objects.add_recipes([user.pk], added)
+        return added
+
+    def bulk_remove(self, user, recipe_ids):
+        with transaction.atomic(using=self.db):
+            removed = super().bulk_remove(user, recipe_ids)
+            ShoppingListItem.objects.add_recipes([user.pk], removed, sign=-1)
+        return removed
+
+    def remove_recipe(self, recipe_id):
+        """Убирает рецепт из всех корзин одним DELETE и один раз вычитает
+        его ингредиенты из списков покупок; возвращает id пользователей.
+        """
+        opts = self.model._meta
+        quote_name = connections[self.db].ops.quote_name
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {quote_name(opts.db_table)} '
+                    f'WHERE {opts.get_field("recipe").column} = %s '
+                    f'RETURNING {opts.get_field("user").column}',
+                    [recipe_id],
+                )
+                user_ids = [row[0] for row in cursor.fetchall()]
+            ShoppingListItem.objects.add_recipes(
+                user_ids, [recipe_id], sign=-1
+            )
+        return user_ids
+
+
 class AbstractFavoriteShoppingModel(models.Model):
     user = models.ForeignKey(
         User,
@@ -158,6 +344,8 @@ class AbstractFavoriteShoppingModel(models.Model):
         verbose_name='Рецепт',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -177,6 +365,17 @@ class FavoriteRecipe(AbstractFavoriteShoppingModel):
 
 
 class ShoppingCart(AbstractFavoriteShoppingModel):
+    # Строки удаленного рецепта убирает сигнал pre_delete рецепта
+    # (ShoppingCartQuerySet.remove_recipe) одним запросом, без каскада.
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        related_name='%(app_label)s_%(class)s_recipe',
+        verbose_name='Рецепт',
+    )
+
+    objects = ShoppingCartQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
@@ -189,3 +388,164 @@ class ShoppingCart(AbstractFavoriteShoppingModel):
 
     def __str__(self) -> str:
         return f'Пользователь {self.user} - рецепт {self.recipe}'
+
+
+class ShoppingListItemManager(models.Manager):
+    def add_amounts(self, user_ids, amounts):
+        """Прибавляет к спискам покупок пользователей изменения количеств.
+
+        ``amounts`` — словарь ``{ingredient_id: delta}``; дельта может быть
+        отрицательной. Строки с нулевым итогом удаляются.
+        """
+        amounts = {pk: delta for pk, delta in amounts.items() if delta}
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, ingredient_id=pk, total_amount=0)
+                for user_id in user_ids
+                for pk, delta in amounts.items()
+                if delta > 0
+            ),
+            ignore_conflicts=True,
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        items.update(
+            total_amount=models.F('total_amount')
+            + models.Case(
+                *(
+                    models.When(ingredient_id=pk, then=models.Value(delta))
+                    for pk, delta in amounts.items()
+                ),
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            )
+        )
+        items.filter(total_amount__lte=0).delete()
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        amounts = {}
+        for pk, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', 'amount'):
+            amounts[pk] = amounts.get(pk, 0) + sign * amount
+        self.add_amounts(user_ids, amounts)
+
+    def live_totals(self):
+        """Итоги, посчитанные заново по рецептам в списках покупок."""
+        return (
+            RecipeIngredient.objects.filter(
+                recipe__recipes_shoppingcart_recipe__isnull=False
+            )
+            .values_list(
+                'recipe__recipes_shoppingcart_recipe__user', 'ingredient'
+            )
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+        )
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.IntegerField('Общее количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_ingredient_shopping_list',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.ingredient} {self.total_amount}'
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    def add(self, user_ids, recipes):
+        """Раскладывает рецепты по лентам пользователей.
+
+        ``recipes`` — пары ``(recipe_id, pub_date)``.
+        """
+        recipes = list(recipes)
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id, recipe_id=recipe_id, pub_date=pub_date
+                )
+                for user_id in user_ids
+                for recipe_id, pub_date in recipes
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def trim(self, limit):
+        """Оставляет в каждой ленте не более ``limit`` новых записей."""
+        return self.filter(
+            pk__in=ranked_pks(
+                self,
+                'user_id',
+                (models.F('pub_date').desc(), models.F('recipe_id').desc()),
+                '>',
+                limit,
+            )
+        ).delete()[0]
+
+
+class FeedEntry(models.Model):
+    """Запись в ленте подписок пользователя.
+
+    Заполняется при публикации рецепта (fan-out on write); рецепты
+    популярных авторов в ленты не раскладываются и читаются при запросе.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_user_recipe_feed'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='recipes_feed_user_date_recipe',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'Лента {self.user}: {self.recipe}'
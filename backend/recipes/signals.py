@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from recipes.models import (
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+
+# Пока флаг установлен, сигналы ингредиентов рецепта не трогают списки
+# покупок: вызывающий код применяет изменения сам, одним запросом.
+_cart_totals_suspended = ContextVar('cart_totals_suspended', default=False)
+
+
+@contextmanager
+def cart_totals_suspended():
+    """Отключает пересчет списков покупок в сигналах ингредиентов."""
+    token = _cart_totals_suspended.set(True)
+    try:
+        yield
+    finally:
+        _cart_totals_suspended.reset(token)
+
+
+def cart_user_ids(recipe_id):
+    return ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+        'user_id', flat=True
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_added(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipes(
+            [instance.user_id], [instance.recipe_id]
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_removed(sender, instance, **kwargs):
+    # Сигнал приходит до DELETE, поэтому строка блокируется: при
+    # параллельном удалении итоги уменьшит только одна из транзакций.
+    if sender.objects.select_for_update().filter(pk=instance.pk).exists():
+        ShoppingListItem.objects.add_recipes(
+            [instance.user_id], [instance.recipe_id], sign=-1
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    # Ингредиенты еще на месте: итоги уменьшаются одним изменением на
+    # всех пользователей, строки корзин удаляются одним запросом.
+    ShoppingCart.objects.remove_recipe(instance.pk)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def recipe_ingredient_changing(sender, instance, **kwargs):
+    if _cart_totals_suspended.get():
+        return
+    instance._previous = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('ingredient_id', 'amount')
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    if _cart_totals_suspended.get():
+        return
+    amounts = {instance.ingredient_id: instance.amount}
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        ingredient_id, amount = previous
+        amounts[ingredient_id] = amounts.get(ingredient_id, 0) - amount
+    ShoppingListItem.objects.add_amounts(
+        cart_user_ids(instance.recipe_id), amounts
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_removed(sender, instance, **kwargs):
+    if _cart_totals_suspended.get():
+        return
+    ShoppingListItem.objects.add_amounts(
+        cart_user_ids(instance.recipe_id),
+        {instance.ingredient_id: -instance.amount},
+    )
@@ -0,0 +1,42 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 их содержимого.
+
+    Одинаковые файлы хранятся один раз: если файл с таким хешем уже есть,
+    запись пропускается, у файла обновляется время изменения и
+    возвращается его имя. Каталог из ``upload_to``
+    сохраняется, внутри него файлы раскладываются по первым двум
+    символам хеша. Файлы не удаляются при удалении или замене ссылок на
+    них — их убирает команда ``collect_media_garbage``.
+    """
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+        try:
+            # Новая ссылка на файл продлевает ему жизнь: сборщик мусора
+            # не трогает файлы моложе ``--min-age``.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super()._save(name, content)
+        return name
+
+
+recipe_image_storage = ContentAddressedStorage()